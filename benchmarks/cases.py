@@ -0,0 +1,201 @@
+"""The benchmark cases. Each one returns a flat dict of numbers, `metric` names the throughput
+(higher is better) that `benchmarks.run --baseline` compares.
+
+Populations keep the density of core.parameters (uranium_start + neutrons_start particles in a
+box of bounding_parameter), so the box grows with N and the curves show scaling, not crowding.
+"""
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from core import kernels
+from core.collisions import brute_force_pairs, cell_list_pairs, find_contacts
+from core.domains import DomainSearch
+from core.parameters import bounding_parameter, neutrons_start, radius_multiplicator, uranium_start
+from core.particles import ParticleStore, URANIUM_235
+from core.simulation import Simulation
+from core.snapshots import SnapshotReader, SnapshotWriter
+from core.telemetry import PHASES, Telemetry
+
+SIZES = (100, 1000, 5000, 20000)
+QUICK_SIZES = (100, 1000)
+SCALING_SIZES = (20000, 100000) # where the split search can pay off (MIN_PARTICLES_PER_WORKER each)
+MAX_PYTHON_N = 5000 # the O(N^2) reference gets too slow beyond this
+
+
+def _timed(function, min_time=1.0, min_calls=3):
+    """calls `function` until it ran min_calls times and min_time seconds, returns (calls, seconds)"""
+    calls, elapsed = 0, 0.0
+    while calls < min_calls or elapsed < min_time:
+        start = time.perf_counter()
+        function()
+        elapsed += time.perf_counter() - start
+        calls += 1
+    return calls, elapsed
+
+
+def simulation_for(n, backend="numpy", seed=0, **kwargs):
+    """Simulation with n particles at the default density and neutron share, plus its particles.
+    With workers their processes are already running, close() the simulation afterwards."""
+    neutrons = max(1, round(n * neutrons_start / (neutrons_start + uranium_start)))
+    bound = bounding_parameter * (n / (neutrons_start + uranium_start)) ** (1 / 3)
+    simulator = Simulation(10**9, neutrons, n - neutrons, backend=backend, bounding_parameter=bound, seed=seed, **kwargs)
+    simulator.start_workers() # spawn cost stays out of the timings, like in bench_search
+    return simulator, simulator._innitialize_particles()
+
+
+def bench_step(n, backend="numpy", workers=None, warmup=3, min_time=1.0):
+    simulator, particles = simulation_for(n, backend, workers=workers)
+    try:
+        metadata = simulator.new_metadata(particles)
+        for _ in range(warmup): # numba compiles here
+            simulator.one_simulation_step(particles, metadata)
+
+        start_size = len(particles)
+        steps, seconds = _timed(lambda: simulator.one_simulation_step(particles, metadata), min_time)
+    finally:
+        simulator.close()
+    return {
+        "metric": "steps_per_s",
+        "n": n,
+        "n_end": len(particles),
+        "steps": steps,
+        "seconds": seconds,
+        "steps_per_s": steps / seconds,
+        "particle_steps_per_s": (start_size + len(particles)) / 2 * steps / seconds,
+    }
+
+
+def bench_scaling(n, backend="numpy", workers=None, warmup=3, min_time=2.0):
+    """bench_step with telemetry: steps/s and the share of step time per phase. Only the search is
+    split over the workers, so 1 - search_share of the serial run bounds the speedup (Amdahl)."""
+    telemetry = Telemetry()
+    simulator, particles = simulation_for(n, backend, workers=workers, telemetry=telemetry)
+    try:
+        metadata = simulator.new_metadata(particles)
+        for _ in range(warmup):
+            simulator.one_simulation_step(particles, metadata)
+        first = telemetry.steps
+        steps, seconds = _timed(lambda: simulator.one_simulation_step(particles, metadata), min_time)
+    finally:
+        simulator.close()
+    totals = telemetry.times[first:].sum(axis=0)
+    return {
+        "metric": "steps_per_s",
+        "n": n,
+        "workers": workers or 1,
+        "steps": steps,
+        "seconds": seconds,
+        "steps_per_s": steps / seconds,
+        **{f"{phase}_share": float(total / totals.sum()) for phase, total in zip(PHASES, totals)},
+    }
+
+
+def bench_search(n, method="cell_list", workers=None, min_time=1.0):
+    """the contact search alone, on the initial positions of an n particle simulation"""
+    simulator, particles = simulation_for(n)
+    positions, radii, bound = particles.positions, particles.radius, simulator.bounding_parameter
+    domains = DomainSearch(workers, bound, radius_multiplicator) if method == "domains" else None
+    search = {
+        "cell_list": lambda: find_contacts(positions, radii, bound, radius_multiplicator),
+        "numba": lambda: kernels.find_contacts(positions, radii, bound, radius_multiplicator),
+        "brute_force": lambda: brute_force_pairs(positions, radii, radius_multiplicator),
+        "domains": lambda: domains.find_contacts(positions, radii),
+    }[method]
+    contacts = search() # warmup / compile
+
+    if method == "brute_force":
+        pair_checks = n * (n - 1) // 2
+    else: # candidates of the broad phase, the numba kernel uses similar cells
+        pair_checks = len(cell_list_pairs(positions, 2 * radii.max() * radius_multiplicator, bound))
+    calls, seconds = _timed(search, min_time)
+    if domains is not None:
+        domains.close()
+    return {
+        "metric": "pair_checks_per_s",
+        "n": n,
+        "contacts": len(contacts),
+        "pair_checks": pair_checks,
+        "searches_per_s": calls / seconds,
+        "pair_checks_per_s": pair_checks * calls / seconds,
+    }
+
+
+def _moving_store(n, seed=0):
+    rng = np.random.default_rng(seed)
+    store = ParticleStore(n)
+    store.add(URANIUM_235, rng.uniform(-bounding_parameter, bounding_parameter, (n, 3)), rng.normal(0, 1e7, (n, 3)), 1.0, 1.0)
+    return store
+
+
+def bench_snapshots(n, frames=200, dtype=np.float32, compression=None, keyframe_interval=None, tolerance=0.0):
+    """streams `frames` frames of n moving particles through a SnapshotWriter, then reads them back"""
+    store = _moving_store(n)
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(tmp) / "snapshots"
+        start = time.perf_counter()
+        with SnapshotWriter(directory, dtype=dtype, compression=compression, keyframe_interval=keyframe_interval,
+                            tolerance=tolerance, bound=bounding_parameter) as writer:
+            for _ in range(frames):
+                store.forward()
+                store.reflect(bounding_parameter)
+                writer.write(store)
+        write_seconds = time.perf_counter() - start
+        size = sum(f.stat().st_size for f in directory.iterdir())
+
+        reader = SnapshotReader(directory)
+        start = time.perf_counter()
+        for frame in range(len(reader)):
+            reader.frame(frame)
+        read_seconds = time.perf_counter() - start
+
+        order = np.random.default_rng(0).permutation(len(reader))
+        reader = SnapshotReader(directory) # cold caches again
+        start = time.perf_counter()
+        for frame in order:
+            reader.frame(int(frame))
+        random_seconds = time.perf_counter() - start
+
+    return {
+        "metric": "write_frames_per_s",
+        "n": n,
+        "frames": frames,
+        "bytes": size,
+        "bytes_per_frame": size / frames,
+        "write_frames_per_s": frames / write_seconds,
+        "write_mb_per_s": n * frames * 3 * 8 / write_seconds / 1e6, # float64 input
+        "read_frames_per_s": frames / read_seconds,
+        "random_read_frames_per_s": frames / random_seconds,
+    }
+
+
+def bench_frames(n, frames=200):
+    """viz_cached.frame_data (positions + colours of one frame) on a freshly written cache"""
+    from viz.viz_cached import frame_data, open_snapshots # pulls in matplotlib
+
+    store = _moving_store(n)
+    with tempfile.TemporaryDirectory() as tmp:
+        cache_dir = Path(tmp)
+        with SnapshotWriter(cache_dir / "snapshots", bound=bounding_parameter) as writer:
+            for _ in range(frames):
+                store.forward()
+                store.reflect(bounding_parameter)
+                writer.write(store)
+
+        start = time.perf_counter()
+        reader = open_snapshots(cache_dir)
+        open_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        for frame in range(len(reader)):
+            frame_data(reader, frame)
+        seconds = time.perf_counter() - start
+
+    return {
+        "metric": "frames_per_s",
+        "n": n,
+        "frames": frames,
+        "open_seconds": open_seconds,
+        "frames_per_s": frames / seconds,
+    }
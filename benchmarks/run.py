@@ -0,0 +1,214 @@
+"""Benchmark suite: step time, contact search, snapshot I/O, viz_cached frame loading and the
+strong scaling of one run over search workers.
+
+    python -m benchmarks.run                              # full suite -> benchmarks/results/<time>.json
+    python -m benchmarks.run --quick --only step search   # small sizes, some groups
+    python -m benchmarks.run --save-baseline              # also store it as benchmarks/baseline.json
+    python -m benchmarks.run --only search --workers 8 32 # plus the search split over 8 and 32 processes
+    python -m benchmarks.run --only scaling --workers 2 4 8 16 32 # speedup table of one run (default: 2, 4, ... cores)
+    python -m benchmarks.run --baseline benchmarks/baseline.json --tolerance 0.2
+
+Every case runs in a fresh process, so `peak_rss_mb` is the peak of that case alone.
+With --baseline, cases whose metric dropped by more than the tolerance are listed and the exit
+code is 1, so it can gate a CI job.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+import numpy as np
+
+from benchmarks import cases
+from core import kernels
+
+BENCH_DIR = Path(__file__).resolve().parent
+BASELINE = BENCH_DIR / "baseline.json"
+GROUPS = ("step", "search", "snapshots", "frames", "scaling")
+
+
+def plan(groups, sizes, backends, workers=(), scaling_sizes=cases.SCALING_SIZES):
+    """[(name, case function name, kwargs)] for the selected groups, `workers`: process counts for the split search"""
+    jobs = []
+    if "step" in groups:
+        for backend in backends:
+            for n in sizes:
+                if backend == "python" and n > cases.MAX_PYTHON_N:
+                    continue
+                jobs.append((f"step/{backend}/n={n}", "bench_step", {"n": n, "backend": backend}))
+                if backend != "python":
+                    for count in workers:
+                        jobs.append((f"step/{backend}-w{count}/n={n}", "bench_step", {"n": n, "backend": backend, "workers": count}))
+    if "search" in groups:
+        methods = ["cell_list"] + (["numba"] if "numba" in backends else []) + (["brute_force"] if "python" in backends else [])
+        for method in methods:
+            for n in sizes:
+                if method == "brute_force" and n > cases.MAX_PYTHON_N:
+                    continue
+                jobs.append((f"search/{method}/n={n}", "bench_search", {"n": n, "method": method}))
+        for count in workers:
+            for n in sizes:
+                jobs.append((f"search/domains-w{count}/n={n}", "bench_search", {"n": n, "method": "domains", "workers": count}))
+    if "snapshots" in groups:
+        variants = {
+            "float32": {},
+            "float16+zlib": {"dtype": np.float16, "compression": "zlib"},
+            "delta": {"keyframe_interval": 100, "tolerance": 1e-3},
+        }
+        for variant, kwargs in variants.items():
+            for n in sizes:
+                jobs.append((f"snapshots/{variant}/n={n}", "bench_snapshots", {"n": n, **kwargs}))
+    if "frames" in groups:
+        for n in sizes:
+            jobs.append((f"frames/n={n}", "bench_frames", {"n": n}))
+    if "scaling" in groups:
+        for backend in backends:
+            if backend == "python":
+                continue
+            for n in scaling_sizes:
+                jobs.append((f"scaling/{backend}/n={n}", "bench_scaling", {"n": n, "backend": backend}))
+                for count in workers:
+                    jobs.append((f"scaling/{backend}-w{count}/n={n}", "bench_scaling", {"n": n, "backend": backend, "workers": count}))
+    return jobs
+
+
+def scaling_table(results):
+    """Rows (name, workers, steps/s, speedup, Amdahl bound at that many workers, Amdahl ceiling) of the
+    scaling cases. The bounds come from the search share of the serial run, the only part that is split."""
+    serial = {(entry["name"].split("/")[1], entry["n"]): entry for entry in results
+              if entry["name"].startswith("scaling/") and "-w" not in entry["name"]}
+    rows = []
+    for entry in results:
+        if not entry["name"].startswith("scaling/"):
+            continue
+        base = serial.get((entry["name"].split("/")[1].split("-w")[0], entry["n"]))
+        if base is None:
+            continue
+        parallel = base["search_share"]
+        workers = entry["workers"]
+        rows.append((entry["name"], workers, entry["steps_per_s"], entry["steps_per_s"] / base["steps_per_s"],
+                     1 / ((1 - parallel) + parallel / workers), 1 / (1 - parallel) if parallel < 1 else float("inf")))
+    return rows
+
+
+def _run_case(function_name, kwargs):
+    result = getattr(cases, function_name)(**kwargs)
+    result["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # kB on linux
+    return result
+
+
+def run_isolated(function_name, kwargs):
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+        return pool.submit(_run_case, function_name, kwargs).result()
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "numba": getattr(kernels.numba, "__version__", None),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """[(name, metric, baseline value, current value, ratio)] of the cases present in both, and the regressions"""
+    previous = {entry["name"]: entry for entry in baseline["results"]}
+    rows, regressions = [], []
+    for entry in results:
+        old = previous.get(entry["name"])
+        if old is None or entry["metric"] not in old:
+            continue
+        metric = entry["metric"]
+        ratio = entry[metric] / old[metric] if old[metric] else float("inf")
+        row = (entry["name"], metric, old[metric], entry[metric], ratio)
+        rows.append(row)
+        if ratio < 1 - tolerance:
+            regressions.append(row)
+    return rows, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the simulation, the contact search, snapshot I/O and frame loading.")
+    parser.add_argument("--only", nargs="+", choices=GROUPS, default=[group for group in GROUPS if group != "scaling"],
+                        help="default: all but scaling, which takes minutes at its sizes")
+    parser.add_argument("--sizes", type=int, nargs="+", default=None, help=f"particle counts, default {cases.SIZES}")
+    parser.add_argument("--quick", action="store_true", help=f"sizes {cases.QUICK_SIZES} only")
+    parser.add_argument("--backends", nargs="+", choices=kernels.BACKENDS, default=None,
+                        help="step backends, default numpy (+ numba if installed)")
+    parser.add_argument("--workers", type=int, nargs="+", default=None,
+                        help="also time the search split over this many processes (scaling: default 2, 4, ... up to the cores)")
+    parser.add_argument("--out", type=Path, default=None)
+    parser.add_argument("--baseline", type=Path, default=None, help="compare against this results file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative drop before it counts as regression")
+    parser.add_argument("--save-baseline", action="store_true", help=f"also write the results to {BASELINE.name}")
+    args = parser.parse_args(argv)
+
+    sizes = args.sizes or (cases.QUICK_SIZES if args.quick else cases.SIZES)
+    backends = args.backends or (["numpy", "numba"] if kernels.numba is not None else ["numpy"])
+    workers = args.workers
+    if workers is None:
+        workers = [2 ** k for k in range(1, (os.cpu_count() or 1).bit_length())] if "scaling" in args.only else []
+
+    results = []
+    for name, function_name, kwargs in plan(args.only, sizes, backends, workers, args.sizes or cases.SCALING_SIZES):
+        result = run_isolated(function_name, kwargs)
+        result["name"] = name
+        results.append(result)
+        print(f"{name:40s} {result['metric']:>20s} {result[result['metric']]:14.1f}   peak {result['peak_rss_mb']:.0f} MB", flush=True)
+
+    rows = scaling_table(results)
+    if rows:
+        print(f"\n{'scaling':40s} {'workers':>7s} {'steps/s':>10s} {'speedup':>8s} {'amdahl':>7s} {'ceiling':>8s}")
+        for name, count, rate, speedup, bound, ceiling in rows:
+            print(f"{name:40s} {count:7d} {rate:10.2f} {speedup:8.2f} {bound:7.2f} {ceiling:8.1f}")
+        if (os.cpu_count() or 1) < max(row[1] for row in rows):
+            print(f"only {os.cpu_count()} cpus here, more workers than cpus share them")
+
+    report = {"environment": environment(), "results": results,
+              "scaling": [dict(zip(("name", "workers", "steps_per_s", "speedup", "amdahl_bound", "amdahl_ceiling"), row))
+                          for row in rows]}
+    out = args.out or BENCH_DIR / "results" / f"bench_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with out.open("w", encoding="utf-8") as f:
+        json.dump(report, f, indent=1)
+    print(f"Results at {out}")
+    if args.save_baseline:
+        with BASELINE.open("w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1)
+        print(f"Baseline at {BASELINE}")
+
+    if args.baseline is not None:
+        with args.baseline.open("r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        rows, regressions = compare(results, baseline, args.tolerance)
+        print(f"\ncompared to {args.baseline} ({baseline['environment'].get('revision')}):")
+        for name, metric, old, new, ratio in rows:
+            flag = "  <-- regression" if (name, metric, old, new, ratio) in regressions else ""
+            print(f"{name:40s} {metric:>20s} {old:14.1f} -> {new:14.1f}  x{ratio:.2f}{flag}")
+        if regressions:
+            print(f"{len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
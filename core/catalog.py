@@ -0,0 +1,242 @@
+"""SQLite catalog of the cached runs: config, summary statistics and count series of every run in one file.
+
+    python -m core.catalog sync        # index what is in cached_runs/, only new or changed runs are read
+    python -m core.catalog query --where "uranium_start = 1000 and threshold_step < 2000" --order-by peak_neutrons
+    python -m core.catalog summary --group-by uranium_start fission_prob_hardcoded_parameter
+
+RunCache adds a run to cached_runs/catalog.sqlite when it is built and drops it when it is removed
+or evicted, so queries never open a run directory. `sync` picks up runs that got into cached_runs/
+some other way (the old <uranium>_<neutrons>_<bound>_<prob>/ folders, copies, deletes by hand).
+The count series are stored as zlib-compressed int32 arrays of shape (steps + 1, 4), columns in
+SERIES_KEYS order; `series(key)` gives them back as {count_key: array}. Every constant of a run's
+config can be filtered with json_extract(config, '$.<name>'). The backend column is python for the
+old folders (written before the batched backends existed) and NULL for other runs that don't record it.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+from core.parameters import threshold_factor_uranium
+
+CATALOG_ROOT = Path(__file__).resolve().parents[1] / "cached_runs"
+SERIES_KEYS = ("uranium_counts", "neutron_counts", "barium_counts", "krypton_counts")
+CONFIG_COLUMNS = {"uranium_start": "INTEGER", "neutrons_start": "INTEGER", "bounding_parameter": "REAL",
+                  "fission_prob_hardcoded_parameter": "REAL", "seed": "INTEGER", "simulation_steps": "INTEGER",
+                  "uranium_threshold_factor": "REAL", "backend": "TEXT"}
+STAT_COLUMNS = {"steps": "INTEGER", "peak_neutrons": "INTEGER", "peak_neutrons_step": "INTEGER", "threshold_step": "INTEGER",
+                "final_uranium": "INTEGER", "final_neutrons": "INTEGER", "final_barium": "INTEGER", "final_krypton": "INTEGER"}
+COLUMNS = ("key", "path", "modified", *CONFIG_COLUMNS, *STAT_COLUMNS, "config")
+
+
+def _old_folder_config(name):
+    """the config in the name of an old <uranium>_<neutrons>_<bound>_<prob> folder, None for other names"""
+    parts = name.split("_")
+    try:
+        return {"uranium_start": int(parts[0]), "neutrons_start": int(parts[1]), "bounding_parameter": float(parts[2]),
+                "fission_prob_hardcoded_parameter": None if parts[3].lower() == "none" else float(parts[3])} if len(parts) == 4 else None
+    except ValueError:
+        return None
+
+
+def read_run_config(directory):
+    """run_config.json of a run directory, or the config in the name of an old <uranium>_<neutrons>_<bound>_<prob> folder"""
+    config_path = Path(directory) / "run_config.json"
+    old_config = _old_folder_config(Path(directory).name)
+    if config_path.exists():
+        with config_path.open("r", encoding="utf-8") as f:
+            config = json.load(f)
+    else:
+        config = old_config
+    if config is not None and old_config is not None:
+        config.setdefault("backend", "python") # the old folders were all run on the reference path
+    return config
+
+
+def run_statistics(counts, uranium_threshold_factor=threshold_factor_uranium):
+    """summary columns of a (steps + 1, 4) count array"""
+    uranium, neutrons = counts[:, 0], counts[:, 1]
+    reached = np.flatnonzero(uranium <= uranium_threshold_factor * uranium[0]) # ensemble.time_to_threshold
+    final = counts[-1]
+    return {"steps": len(counts) - 1, "peak_neutrons": int(neutrons.max()), "peak_neutrons_step": int(neutrons.argmax()),
+            "threshold_step": int(reached[0]) if len(reached) else None, "final_uranium": int(final[0]),
+            "final_neutrons": int(final[1]), "final_barium": int(final[2]), "final_krypton": int(final[3])}
+
+
+class Catalog:
+    """the catalog of the runs below `root`, see the module docstring. Use it as a context manager or close() it."""
+
+    def __init__(self, path=None, root=CATALOG_ROOT):
+        self.root = Path(root)
+        self.path = Path(path) if path is not None else self.root / "catalog.sqlite"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.outdated = not self.path.exists() # true until a sync has read what is on disk
+        self.connection = sqlite3.connect(self.path, timeout=30) # several runs can finish at once
+        self.connection.row_factory = sqlite3.Row
+        columns = ", ".join(f"{name} {kind}" for name, kind in {**CONFIG_COLUMNS, **STAT_COLUMNS}.items())
+        with self.connection:
+            self.connection.execute(f"CREATE TABLE IF NOT EXISTS runs (key TEXT PRIMARY KEY, path TEXT, modified REAL, {columns}, config TEXT)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS series (key TEXT PRIMARY KEY, counts BLOB)")
+            existing = {row["name"] for row in self.connection.execute("PRAGMA table_info(runs)")}
+            for name, kind in {**CONFIG_COLUMNS, **STAT_COLUMNS}.items():
+                if name not in existing: # catalog of an older version, the next sync fills the new column
+                    self.connection.execute(f"ALTER TABLE runs ADD COLUMN {name} {kind}")
+                    self.connection.execute("UPDATE runs SET modified = NULL")
+                    self.outdated = True
+            for name in ("uranium_start", "bounding_parameter", "fission_prob_hardcoded_parameter"):
+                self.connection.execute(f"CREATE INDEX IF NOT EXISTS runs_{name} ON runs ({name})")
+
+    def add(self, directory):
+        """(re)indexes the run in `directory`, False if it has no metadata.json or no config"""
+        directory = Path(directory)
+        metadata_path = directory / "metadata.json"
+        config = read_run_config(directory)
+        if config is None or not metadata_path.exists():
+            return False
+        with metadata_path.open("r", encoding="utf-8") as f:
+            metadata = json.load(f)
+        counts = np.column_stack([np.asarray(metadata[key], dtype=np.int64) for key in SERIES_KEYS])
+
+        row = {"key": directory.name, "path": os.path.relpath(directory, self.root), "modified": metadata_path.stat().st_mtime,
+               **{name: config.get(name) for name in CONFIG_COLUMNS},
+               **run_statistics(counts, config.get("uranium_threshold_factor", threshold_factor_uranium)),
+               "config": json.dumps(config)}
+        with self.connection:
+            self.connection.execute(f"INSERT OR REPLACE INTO runs ({', '.join(row)}) VALUES ({', '.join('?' * len(row))})",
+                                    tuple(row.values()))
+            self.connection.execute("INSERT OR REPLACE INTO series (key, counts) VALUES (?, ?)",
+                                    (row["key"], zlib.compress(counts.astype("<i4").tobytes())))
+        return True
+
+    def remove(self, *keys):
+        with self.connection:
+            self.connection.executemany("DELETE FROM runs WHERE key = ?", [(key,) for key in keys])
+            self.connection.executemany("DELETE FROM series WHERE key = ?", [(key,) for key in keys])
+
+    def sync(self):
+        """indexes new and changed runs below root and drops the ones that are gone, returns (added, removed) keys"""
+        known = {row["key"]: row["modified"] for row in self.connection.execute("SELECT key, modified FROM runs")}
+        self.outdated = False
+        found, added = set(), []
+        for metadata_path in sorted(self.root.glob("*/metadata.json")) + sorted(self.root.glob("runs/*/metadata.json")):
+            key = metadata_path.parent.name
+            found.add(key)
+            if known.get(key) != metadata_path.stat().st_mtime and self.add(metadata_path.parent):
+                added.append(key)
+        removed = [key for key in known if key not in found]
+        self.remove(*removed)
+        return added, removed
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM runs").fetchone()[0]
+
+    def query(self, where=None, params=(), order_by=None, limit=None, columns=COLUMNS, **equals):
+        """Rows of the runs table as dicts (config decoded). `equals` are column == value filters
+        (None matches NULL, i.e. the cross-section formula), `where` is extra SQL with `params`."""
+        unknown = [name for name in (*equals, *columns) if name not in COLUMNS]
+        if unknown:
+            raise ValueError(f"unknown columns {unknown}, expected some of {COLUMNS}")
+        clauses = [f"{name} IS ?" for name in equals] + ([f"({where})"] if where else [])
+        sql = f"SELECT {', '.join(columns)} FROM runs"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        if order_by:
+            sql += f" ORDER BY {order_by}"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        rows = [dict(row) for row in self.connection.execute(sql, (*equals.values(), *params))]
+        for row in rows:
+            if "config" in row:
+                row["config"] = json.loads(row["config"])
+        return rows
+
+    def summary(self, group_by=("uranium_start", "neutrons_start", "bounding_parameter", "fission_prob_hardcoded_parameter", "backend"),
+                where=None, params=()):
+        """runs, threshold and neutron statistics per group of equal `group_by` columns"""
+        unknown = [name for name in group_by if name not in COLUMNS]
+        if unknown:
+            raise ValueError(f"unknown columns {unknown}, expected some of {COLUMNS}")
+        groups = ", ".join(group_by)
+        sql = (f"SELECT {groups}, COUNT(*) AS runs, AVG(threshold_step IS NOT NULL) AS reached_fraction, "
+               "AVG(threshold_step) AS mean_threshold_step, MIN(threshold_step) AS min_threshold_step, "
+               "MAX(threshold_step) AS max_threshold_step, AVG(peak_neutrons) AS mean_peak_neutrons, "
+               "MAX(peak_neutrons) AS max_peak_neutrons, AVG(final_uranium) AS mean_final_uranium, "
+               "AVG(final_barium) AS mean_final_barium FROM runs")
+        if where:
+            sql += f" WHERE {where}"
+        sql += f" GROUP BY {groups} ORDER BY {groups}"
+        return [dict(row) for row in self.connection.execute(sql, params)]
+
+    def series(self, key):
+        """{count_key: array} of a run, None if it is not in the catalog"""
+        row = self.connection.execute("SELECT counts FROM series WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        counts = np.frombuffer(zlib.decompress(row["counts"]), dtype="<i4").reshape(-1, len(SERIES_KEYS)).astype(np.int64)
+        return {count_key: counts[:, k] for k, count_key in enumerate(SERIES_KEYS)}
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _print_rows(rows):
+    if not rows:
+        print("no runs")
+        return
+    columns = list(rows[0])
+    cells = [[f"{value:.6g}" if isinstance(value, float) else str(value) for value in row.values()] for row in rows]
+    widths = [max(len(column), *(len(line[k]) for line in cells)) for k, column in enumerate(columns)]
+    for line in [columns] + cells:
+        print("  ".join(cell.ljust(width) for cell, width in zip(line, widths)).rstrip())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query the catalog of cached runs.")
+    parser.add_argument("--root", type=Path, default=CATALOG_ROOT, help="cache directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("sync", help="index new and changed runs, drop the ones that are gone")
+    query = commands.add_parser("query", help="one line per run")
+    query.add_argument("--where", default=None, help="SQL condition, e.g. \"peak_neutrons > 1000\"")
+    query.add_argument("--order-by", default=None)
+    query.add_argument("--limit", type=int, default=None)
+    query.add_argument("--columns", nargs="+", default=["key", *CONFIG_COLUMNS, *STAT_COLUMNS])
+    query.add_argument("--json", action="store_true", help="print json instead of a table")
+    summary = commands.add_parser("summary", help="statistics per group of runs")
+    summary.add_argument("--group-by", nargs="+", default=["uranium_start", "neutrons_start", "bounding_parameter",
+                                                           "fission_prob_hardcoded_parameter", "backend"])
+    summary.add_argument("--where", default=None)
+    summary.add_argument("--json", action="store_true", help="print json instead of a table")
+    args = parser.parse_args(argv)
+
+    with Catalog(root=args.root) as catalog:
+        if args.command == "sync" or catalog.outdated: # a new catalog starts from what is on disk
+            added, removed = catalog.sync()
+            if args.command == "sync":
+                print(f"{len(added)} runs indexed, {len(removed)} removed, {len(catalog)} in {catalog.path}")
+        try:
+            if args.command == "query":
+                rows = catalog.query(args.where, order_by=args.order_by, limit=args.limit, columns=args.columns)
+            elif args.command == "summary":
+                rows = catalog.summary(args.group_by, args.where)
+            else:
+                return
+        except (ValueError, sqlite3.Error) as error:
+            raise SystemExit(str(error))
+        if args.json:
+            print(json.dumps(rows))
+        else:
+            _print_rows(rows)
+
+
+if __name__ == "__main__":
+    main()
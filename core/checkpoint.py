@@ -0,0 +1,93 @@
+"""Checkpoints of a running simulation, so a killed run can be resumed and a finished one extended.
+
+One checkpoint is a single .npz file: the particle arrays, the count series, the step index,
+the state of the simulation's random generator and, for adaptive runs, the pending quiet window. It is written to a temporary file and renamed, so the file on disk is
+always a complete checkpoint.
+
+    simulator.simulate(checkpoint_path="run.ckpt.npz", checkpoint_every=1000)
+    # ... killed, or done and should go on for longer:
+    Simulation(200_000, ...).simulate(resume_from="run.ckpt.npz")
+
+Continuing from a checkpoint gives bit-for-bit the same particles, counts and fissions as a run
+that was never interrupted (same backend, box and fission probability, which are checked).
+"""
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+from core.particles import ParticleStore
+
+FORMAT_VERSION = 2 # 1 saved the global random / np.random states
+PARTICLE_FIELDS = ("positions", "velocities", "mass", "radius", "cooldown", "type_codes", "ids", "next_id")
+
+
+def _encode_state(value):
+    # bit generator states hold arrays (MT19937 key, Philox counter) and numpy integers next to plain ints
+    if isinstance(value, np.ndarray):
+        return {"__ndarray__": value.tolist(), "dtype": value.dtype.str}
+    if isinstance(value, np.integer):
+        return int(value)
+    raise TypeError(f"can't save {type(value).__name__} in a random state")
+
+
+def _decode_state(value):
+    if "__ndarray__" in value:
+        return np.array(value["__ndarray__"], dtype=value["dtype"])
+    return value
+
+
+def random_state_json(rng):
+    """the bit generator state of `rng` as json, for any of numpy's bit generators"""
+    return json.dumps(rng.bit_generator.state, default=_encode_state) # 128 bit integers, too wide for an array
+
+
+def restore_random_state(checkpoint, rng):
+    """sets the np.random.Generator `rng` to the state saved in `checkpoint`"""
+    rng.bit_generator.state = json.loads(str(checkpoint["rng_state"]), object_hook=_decode_state)
+
+
+def write_checkpoint(path, simulator, particles, metadata):
+    """saves everything simulate needs to continue after the last step in `metadata`"""
+    path = Path(path)
+    fission_events = -1
+    if simulator.fission_log is not None:
+        simulator.fission_log.flush() # events up to here are on disk, later ones get dropped on resume
+        fission_events = simulator.fission_log.count
+    touching = getattr(simulator, "_touching", None)
+    payload = {
+        "version": np.int64(FORMAT_VERSION),
+        "backend": np.str_(simulator.backend),
+        "bounding_parameter": np.float64(simulator.bounding_parameter),
+        "fission_prob": np.float64(np.nan if simulator.fission_prob_hardcoded_parameter is None
+                                   else simulator.fission_prob_hardcoded_parameter),
+        "counts": metadata._counts[:metadata.length],
+        "fission_events": np.int64(fission_events),
+        "quiet_steps": np.int64(simulator._quiet_steps),
+        "touching": np.empty((0, 2), dtype=np.intp) if touching is None else touching,
+        "rng_state": np.str_(random_state_json(simulator.rng)),
+        **particles.state(),
+    }
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("wb") as f: # a file object, np.savez would append .npz to a name
+        np.savez(f, **payload)
+    os.replace(tmp, path)
+
+
+def read_checkpoint(path):
+    """{name: array} of a checkpoint file"""
+    with np.load(path, allow_pickle=False) as data:
+        checkpoint = {name: data[name] for name in data.files}
+    if int(checkpoint["version"]) != FORMAT_VERSION:
+        raise ValueError(f"unsupported checkpoint version {int(checkpoint['version'])}")
+    return checkpoint
+
+
+def checkpoint_particles(checkpoint, capacity=None):
+    return ParticleStore.from_state({name: checkpoint[name] for name in PARTICLE_FIELDS}, capacity)
+
+
+def checkpoint_step(path):
+    """number of steps done at the checkpoint"""
+    return len(read_checkpoint(path)["counts"]) - 1
@@ -0,0 +1,202 @@
+from itertools import product
+
+import numpy as np
+
+from core.particles import DELETED
+
+# the own cell plus the 13 neighbour cells "after" it, so every pair of cells is visited once
+HALF_NEIGHBOURS = [(0, 0, 0)] + [offset for offset in product((-1, 0, 1), repeat=3) if offset > (0, 0, 0)]
+MAX_CELLS_PER_AXIS = 2 ** 20  # keeps the flat cell keys inside int64
+
+
+def _empty_pairs():
+    return np.empty((0, 2), dtype=np.intp)
+
+
+def cell_list_pairs(positions, cell_size, bound):
+    """Broad phase: candidate pairs (i < j) of particles in the same or in neighbouring cells.
+
+    The box [-bound, bound]^3 is split into cubic cells at least `cell_size` wide, so every
+    pair closer than `cell_size` is returned. Pairs come back sorted like the nested i/j loop.
+    """
+    count = len(positions)
+    if count < 2:
+        return _empty_pairs()
+
+    cells_per_axis = min(max(int(2 * bound // cell_size), 1), MAX_CELLS_PER_AXIS)
+    cell_size = 2 * bound / cells_per_axis  # stretch the cells so they tile the box exactly
+
+    coords = np.floor((positions + bound) / cell_size).astype(np.intp)
+    np.clip(coords, 0, cells_per_axis - 1, out=coords) # particles sitting on the upper walls
+
+    keys = (coords[:, 0] * cells_per_axis + coords[:, 1]) * cells_per_axis + coords[:, 2]
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    rank = np.empty(count, dtype=np.intp)
+    rank[order] = np.arange(count)
+
+    firsts, seconds = [], []
+    for offset in HALF_NEIGHBOURS:
+        neighbour = coords + offset
+        valid = np.all((neighbour >= 0) & (neighbour < cells_per_axis), axis=1)
+        neighbour_keys = (neighbour[:, 0] * cells_per_axis + neighbour[:, 1]) * cells_per_axis + neighbour[:, 2]
+
+        ends = np.searchsorted(sorted_keys, neighbour_keys, side="right")
+        if offset == (0, 0, 0):
+            starts = rank + 1 # only partners after me in the same cell
+        else:
+            starts = np.searchsorted(sorted_keys, neighbour_keys, side="left")
+        lengths = np.where(valid, np.maximum(ends - starts, 0), 0)
+
+        total = int(lengths.sum())
+        if total == 0:
+            continue
+        firsts.append(np.repeat(np.arange(count), lengths))
+        group_base = starts - (np.cumsum(lengths) - lengths)
+        seconds.append(order[np.repeat(group_base, lengths) + np.arange(total)])
+
+    if not firsts:
+        return _empty_pairs()
+
+    first = np.concatenate(firsts)
+    second = np.concatenate(seconds)
+    i = np.minimum(first, second)
+    j = np.maximum(first, second)
+    sort = np.lexsort((j, i))
+    return np.stack((i[sort], j[sort]), axis=1)
+
+
+def contact_pairs(positions, radii, pairs, radius_multiplicator):
+    """Narrow phase: keep the pairs that are within interaction distance, in one vectorized pass"""
+    if len(pairs) == 0:
+        return pairs
+    i, j = pairs[:, 0], pairs[:, 1]
+    displacement = positions[i] - positions[j]
+    distance_sq = np.einsum("ij,ij->i", displacement, displacement)
+    collision_distance = (radii[i] + radii[j]) * radius_multiplicator
+    return pairs[distance_sq <= collision_distance ** 2]
+
+
+def brute_force_pairs(positions, radii, radius_multiplicator):
+    """all contact pairs by checking every pair row by row -> O(N^2) reference for the cell list"""
+    count = len(positions)
+    pairs = [_empty_pairs()]
+    for i in range(count - 1):
+        displacement = positions[i + 1:] - positions[i]
+        distance_sq = np.einsum("ij,ij->i", displacement, displacement)
+        collision_distance = (radii[i] + radii[i + 1:]) * radius_multiplicator
+        close = np.flatnonzero(distance_sq <= collision_distance ** 2) + i + 1
+        if len(close):
+            pairs.append(np.stack((np.full(len(close), i), close), axis=1))
+    return np.concatenate(pairs)
+
+
+def find_contacts(positions, radii, bound, radius_multiplicator):
+    """contact pairs (i < j) in nested-loop order, found through the cell list"""
+    if len(positions) < 2:
+        return _empty_pairs()
+    cell_size = 2 * radii.max() * radius_multiplicator # largest possible interaction distance
+    candidates = cell_list_pairs(positions, cell_size, bound)
+    return contact_pairs(positions, radii, candidates, radius_multiplicator)
+
+
+def _wall_times(positions, velocities, bound):
+    """time until every particle first reaches a wall of [-bound, bound]^3 (inf if it stands still)"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        times = np.where(velocities > 0, (bound - positions) / velocities,
+                         np.where(velocities < 0, (-bound - positions) / velocities, np.inf))
+    return np.maximum(times.min(axis=1), 0)
+
+
+def _speed_bounds(velocities, mass, contacts):
+    """|v| of every particle, the ones in contact raised to the speed all the kinetic energy of the
+    contacts would give them; and the mask of the particles in contact"""
+    speeds = np.sqrt(np.einsum("ij,ij->i", velocities, velocities))
+    bouncing = np.zeros(len(velocities), dtype=bool)
+    bouncing[contacts.ravel()] = True
+    if bouncing.any():
+        energy = np.sum(mass[bouncing] * speeds[bouncing] ** 2)
+        speeds[bouncing] = np.sqrt(energy / mass[bouncing])
+    return speeds, bouncing
+
+
+def _class_horizon(radii, speeds, cell_size, radius_multiplicator):
+    """earliest contact of two particles further apart than cell_size, from the fastest one per radius class"""
+    horizon = np.inf
+    classes = np.unique(radii)
+    fastest = [speeds[radii == r].max() for r in classes]
+    for a in range(len(classes)):
+        for b in range(a, len(classes)):
+            closing = fastest[a] + fastest[b]
+            if closing > 0:
+                horizon = min(horizon, (cell_size - (classes[a] + classes[b]) * radius_multiplicator) / closing)
+    return horizon
+
+
+def contacts_and_horizon(positions, velocities, radii, mass, bound, radius_multiplicator, skin):
+    """Contact pairs like find_contacts, plus a conservative time until any other pair can get
+    into contact, assuming the pairs in contact only bounce elastically (inf if nothing moves).
+
+    The cell list is built `skin` wider than the interaction distance. Pairs inside it follow
+    straight lines until one of them reaches a wall, their first contact on that line is solved
+    exactly; after the wall no pair closes faster than |v_i| + |v_j| (reflections only flip
+    components). Particles in contact can bounce any time, they can't get faster than all the
+    kinetic energy of the contacts put into them. Pairs beyond the skin get the speed bound per
+    radius class.
+    """
+    if len(positions) < 2:
+        return _empty_pairs(), np.inf
+    cell_size = 2 * radii.max() * radius_multiplicator + skin
+    candidates = cell_list_pairs(positions, cell_size, bound)
+    i, j = candidates[:, 0], candidates[:, 1]
+    displacement = positions[i] - positions[j]
+    distance_sq = np.einsum("ij,ij->i", displacement, displacement)
+    collision_distance = (radii[i] + radii[j]) * radius_multiplicator
+    touching = distance_sq <= collision_distance ** 2
+    contacts = candidates[touching]
+    speeds, bouncing = _speed_bounds(velocities, mass, contacts)
+    horizon = _class_horizon(radii, speeds, cell_size, radius_multiplicator)
+
+    approaching = np.flatnonzero(~touching & (speeds[i] + speeds[j] > 0))
+    if len(approaching):
+        i, j = i[approaching], j[approaching]
+        dx, dv = displacement[approaching], velocities[i] - velocities[j]
+        cd = collision_distance[approaching]
+        closing = speeds[i] + speeds[j]
+        # |dx + dv t| = cd  ->  a t^2 + 2 b t + c = 0
+        a = np.einsum("ij,ij->i", dv, dv)
+        b = np.einsum("ij,ij->i", dx, dv)
+        c = distance_sq[approaching] - cd ** 2
+        discriminant = b * b - a * c
+        hits = (b < 0) & (discriminant >= 0) & (a > 0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            first_contact = np.where(hits, (-b - np.sqrt(np.where(hits, discriminant, 0))) / a, np.inf)
+
+        walls = _wall_times(positions, velocities, bound)
+        walls[bouncing] = 0 # no straight line for these
+        straight = np.minimum(walls[i], walls[j])
+        after_wall = np.where(np.isfinite(straight), straight, 0)[:, None]
+        gap = np.sqrt(np.einsum("ij,ij->i", dx + dv * after_wall, dx + dv * after_wall)) - cd
+        bounded = np.where(np.isfinite(straight), straight + np.maximum(gap, 0) / closing, np.inf)
+        horizon = min(horizon, float(np.where(first_contact < straight, first_contact, bounded).min()))
+    return contacts, horizon
+
+
+def can_interact(cooldown, i, j):
+    """_can_interact of Simulation for arrays of pairs: none of them split, and not just bounced off each other"""
+    return (cooldown[i] != DELETED) & (cooldown[j] != DELETED) & ((cooldown[i] == 0) | (cooldown[i] != cooldown[j]))
+
+
+def first_contacts(pending, particle_count):
+    """Mask of the pending contacts that come first (in nested-loop order) for both of their particles.
+
+    Every earlier contact of these particles is resolved already, so they see the cooldowns and
+    velocities the sequential loop would show them, and they are disjoint: one round of a step can
+    be resolved at once. A particle with several contacts gets them in later rounds, in order.
+    `pending` has to stay in nested-loop order.
+    """
+    order = np.arange(len(pending))
+    first = np.full(particle_count, len(pending), dtype=np.intp)
+    np.minimum.at(first, pending[:, 0], order)
+    np.minimum.at(first, pending[:, 1], order)
+    return (first[pending[:, 0]] == order) & (first[pending[:, 1]] == order)
@@ -0,0 +1,69 @@
+"""Energy-dependent fission probability of a neutron-uranium contact, as a lookup table.
+
+    p(v) = (sigma_0 / sigma_thermal) * (5.22e-2 * v**2 / E_0) ** -alpha, capped at 1
+
+with v the relative speed. The table samples p on a grid that is uniform in log(v), so a lookup
+is one log, an index computation and a linear interpolation, whatever the shape of the curve
+(a measured cross-section with resonances costs the same, see `from_samples`). With the default
+4096 points the power law is reproduced to ~1e-5 relative. Tables are built once per parameter
+set and shared by every simulation in the process.
+"""
+import functools
+
+import numpy as np
+
+from core.parameters import E_0, alpha, cross_section_max_speed, cross_section_points, sigma_0, sigma_thermal
+
+
+class CrossSectionTable:
+    """p(relative speed) sampled at `points` speeds spaced evenly in log between min_speed and max_speed.
+    Below min_speed the first value holds, above max_speed the last one."""
+
+    def __init__(self, min_speed, max_speed, probabilities):
+        self.probabilities = np.asarray(probabilities, dtype=np.float64)
+        self.speeds = np.geomspace(min_speed, max_speed, len(self.probabilities))
+        self._log_min = np.log(min_speed)
+        self._per_log = (len(self.probabilities) - 1) / (np.log(max_speed) - self._log_min)
+        self._slopes = np.append(np.diff(self.probabilities), 0.0)
+
+    @classmethod
+    def power_law(cls, sigma_0, sigma_thermal, E_0, alpha, points, max_speed):
+        # below the speed where the power law reaches 1 the probability stays 1, the grid starts there
+        min_speed = np.sqrt(E_0 / 5.22e-2 * (sigma_0 / sigma_thermal) ** (1 / alpha))
+        speeds = np.geomspace(min_speed, max(max_speed, 2 * min_speed), points)
+        probabilities = np.minimum((sigma_0 / sigma_thermal) * (5.22e-2 * speeds ** 2 / E_0) ** (-alpha), 1.0)
+        return cls(speeds[0], speeds[-1], probabilities)
+
+    @classmethod
+    def from_samples(cls, speeds, probabilities, points=cross_section_points):
+        """table of measured (speed, probability) pairs, resampled onto the log grid. The speeds
+        must be increasing and positive; below the first one its probability holds, like in any table."""
+        speeds = np.asarray(speeds, dtype=np.float64)
+        if len(speeds) < 2 or not np.all(np.diff(speeds) > 0):
+            raise ValueError("from_samples needs at least two speeds in increasing order")
+        if speeds[0] <= 0:
+            raise ValueError(f"the first sample speed is {speeds[0]}, the log grid needs positive speeds "
+                             "(drop the 0 sample, the table holds the first value below its first speed)")
+        grid = np.geomspace(speeds[0], speeds[-1], points)
+        return cls(grid[0], grid[-1], np.interp(np.log(grid), np.log(speeds), probabilities))
+
+    def kernel_arrays(self):
+        """(probabilities, log of min_speed, grid points per log unit, slopes): what a compiled
+        lookup needs to do the same interpolation as __call__ (kernels.resolve_contacts)"""
+        return self.probabilities, self._log_min, self._per_log, self._slopes
+
+    def __call__(self, v_dif):
+        """fission probability for an array of relative speeds (0 for identical velocities)"""
+        v_dif = np.asarray(v_dif, dtype=np.float64)
+        with np.errstate(divide="ignore"):
+            position = np.clip((np.log(v_dif) - self._log_min) * self._per_log, 0, len(self.probabilities) - 1)
+        index = position.astype(np.intp)
+        probability = self.probabilities[index] + (position - index) * self._slopes[index]
+        return np.where(v_dif > 0, probability, 0.0) # no relative motion, no reaction
+
+
+@functools.lru_cache(maxsize=None)
+def cross_section_table(sigma_0=sigma_0, sigma_thermal=sigma_thermal, E_0=E_0, alpha=alpha,
+                        points=cross_section_points, max_speed=cross_section_max_speed):
+    """the table of one parameter set, built on first use"""
+    return CrossSectionTable.power_law(sigma_0, sigma_thermal, E_0, alpha, points, max_speed)
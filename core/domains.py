@@ -0,0 +1,156 @@
+"""Contact search of one simulation split over worker processes (domain decomposition).
+
+The box is cut into slabs along x, one per worker, with the cuts at particle-count quantiles so
+every worker gets the same share even when the particles bunch up. Positions and radii go to a
+shared memory block once per step; a worker searches the particles it owns plus a halo of the
+particles less than one interaction distance above its slab, and keeps the pairs with at least
+one owned particle. So every contact is found by exactly one worker: the one owning its lower
+particle (in x). Ownership is recomputed from the positions every step, which is all the
+migration across slab boundaries there is.
+
+The coordinator merges the pairs back into nested-loop order and resolves them as usual, so a
+run with workers gives exactly the results of the same run without. Workers only search:
+moving, resolving, spawning and removing stay serial in the coordinator, as do the copy into
+shared memory and the merge, so the speedup is bounded by Amdahl's law (README, Backends;
+`python -m benchmarks.run --only scaling` measures it).
+"""
+import multiprocessing as mp
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from core import kernels
+from core.collisions import _empty_pairs, cell_list_pairs, contact_pairs
+
+MIN_PARTICLES_PER_WORKER = 2000 # below this the split costs more than it saves, the search stays local
+
+
+def _views(memory, capacity):
+    """positions (capacity, 3) and radii (capacity,) in the shared block"""
+    positions = np.ndarray((capacity, 3), dtype=np.float64, buffer=memory.buf)
+    radii = np.ndarray((capacity,), dtype=np.float64, buffer=memory.buf, offset=positions.nbytes)
+    return positions, radii
+
+
+def slab_contacts(positions, radii, lower, upper, bound, cell_size, radius_multiplicator, backend="numpy"):
+    """contacts (global indices, i < j) with at least one particle in lower <= x < upper"""
+    x = positions[:, 0]
+    owned = (x >= lower) & (x < upper)
+    members = np.flatnonzero(owned | ((x >= upper) & (x < upper + cell_size * (1 + 1e-9)))) # + halo above
+    if len(members) < 2:
+        return _empty_pairs()
+    local_positions, local_radii = positions[members], radii[members]
+    local_owned = owned[members]
+    if backend == "numba":
+        contacts = kernels.find_contacts(local_positions, local_radii, bound, radius_multiplicator)
+        return members[contacts[local_owned[contacts[:, 0]] | local_owned[contacts[:, 1]]]]
+    candidates = cell_list_pairs(local_positions, cell_size, bound)
+    candidates = candidates[local_owned[candidates[:, 0]] | local_owned[candidates[:, 1]]]
+    return members[contact_pairs(local_positions, local_radii, candidates, radius_multiplicator)] # members is ascending -> i < j
+
+
+def _worker(connection, bound, radius_multiplicator, backend):
+    memory = positions = radii = None
+    connection.send(True) # up and listening
+    while True:
+        message = connection.recv()
+        if message[0] == "attach":
+            positions = radii = None
+            if memory is not None:
+                memory.close()
+            memory = shared_memory.SharedMemory(name=message[1])
+            positions, radii = _views(memory, message[2])
+            connection.send(True) # the old block may go now
+        elif message[0] == "search":
+            _, count, lower, upper, cell_size = message
+            connection.send(slab_contacts(positions[:count], radii[:count], lower, upper, bound, cell_size,
+                                          radius_multiplicator, backend))
+        else: # "stop"
+            positions = radii = None
+            if memory is not None:
+                memory.close()
+            connection.close()
+            return
+
+
+class DomainSearch:
+    """find_contacts on `workers` processes, see the module docstring. The processes are up when
+    the constructor returns, close() stops them. backend "numba" searches every slab with the compiled kernel."""
+
+    def __init__(self, workers, bound, radius_multiplicator, backend="numpy"):
+        self.workers = workers
+        self.backend = backend
+        self.bound = bound
+        self.radius_multiplicator = radius_multiplicator
+        self.capacity = 0
+        self.memory = None
+        self._connections, self._processes = [], []
+        # workers have to share our tracker, their own would unlink the blocks when they exit
+        resource_tracker.ensure_running()
+        for _ in range(workers):
+            ours, theirs = mp.Pipe()
+            process = mp.Process(target=_worker, args=(theirs, bound, radius_multiplicator, backend), daemon=True)
+            process.start()
+            theirs.close()
+            self._connections.append(ours)
+            self._processes.append(process)
+        for connection in self._connections:
+            connection.recv()
+
+    def _allocate(self, capacity):
+        """(re)creates the shared block for `capacity` particles and hands it to the workers"""
+        old = self.memory
+        self.capacity = capacity
+        self.memory = shared_memory.SharedMemory(create=True, size=capacity * 4 * 8)
+        self.positions, self.radii = _views(self.memory, capacity)
+        for connection in self._connections:
+            connection.send(("attach", self.memory.name, capacity))
+        for connection in self._connections:
+            connection.recv()
+        if old is not None:
+            old.close()
+            old.unlink()
+
+    def slabs(self, x):
+        """(lower, upper) x range of every worker, cut at count quantiles"""
+        cuts = [len(x) * k // self.workers for k in range(1, self.workers)]
+        edges = np.partition(x, cuts)[cuts] if cuts else np.empty(0)
+        edges = np.concatenate(([-np.inf], edges, [np.inf]))
+        return list(zip(edges[:-1], edges[1:]))
+
+    def find_contacts(self, positions, radii):
+        """same pairs in the same order as collisions.find_contacts"""
+        count = len(positions)
+        if count < 2:
+            return _empty_pairs()
+        cell_size = 2 * radii.max() * self.radius_multiplicator
+        if count < MIN_PARTICLES_PER_WORKER * self.workers:
+            return slab_contacts(positions, radii, -np.inf, np.inf, self.bound, cell_size, self.radius_multiplicator, self.backend)
+
+        if count > self.capacity:
+            self._allocate(max(count, 2 * self.capacity))
+        self.positions[:count] = positions
+        self.radii[:count] = radii
+        for connection, (lower, upper) in zip(self._connections, self.slabs(positions[:, 0])):
+            connection.send(("search", count, lower, upper, cell_size))
+        pairs = np.concatenate([connection.recv() for connection in self._connections])
+        return pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+
+    def close(self):
+        for connection, process in zip(self._connections, self._processes):
+            if process.is_alive():
+                connection.send(("stop",))
+                process.join(timeout=5)
+            connection.close()
+        self._connections, self._processes = [], []
+        self.positions = self.radii = None
+        if self.memory is not None:
+            self.memory.close()
+            self.memory.unlink()
+            self.memory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
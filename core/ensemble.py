@@ -0,0 +1,178 @@
+"""Ensembles of independent runs over a parameter grid, spread over a process pool.
+
+    python -m core.ensemble --uranium-start 100 1000 --fission-prob 0.1 0.2 --seeds 50 --steps 2000
+"""
+import argparse
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from core.kernels import BACKENDS, resolve_backend
+from core.parameters import (
+    bounding_parameter,
+    fission_prob_hardcoded_parameter,
+    neutrons_start,
+    threshold_factor_uranium,
+    uranium_start,
+    simulation_steps,
+)
+from core.simulation import Simulation
+from core.snapshots import DiscardFrames
+
+GRID_KEYS = ("uranium_start", "neutrons_start", "bounding_parameter", "fission_prob_hardcoded_parameter")
+COUNT_KEYS = ("neutron_counts", "uranium_counts", "barium_counts", "krypton_counts")
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+
+def parameter_grid(uranium_start=(uranium_start,), neutrons_start=(neutrons_start,),
+                   bounding_parameter=(bounding_parameter,), fission_prob_hardcoded_parameter=(fission_prob_hardcoded_parameter,),
+                   seeds=1, base_seed=0):
+    """One config dict per grid point and replica. Every run gets its own child of
+    SeedSequence(base_seed), stored as base_seed and spawn_key (see run_seed), so the streams are
+    independent and the whole ensemble is reproducible."""
+    points = list(itertools.product(uranium_start, neutrons_start, bounding_parameter, fission_prob_hardcoded_parameter))
+    configs = []
+    for point_index, point in enumerate(points):
+        for replica in range(seeds):
+            config = dict(zip(GRID_KEYS, point))
+            config["base_seed"] = base_seed
+            config["spawn_key"] = point_index * seeds + replica
+            configs.append(config)
+    return configs
+
+
+def run_seed(config):
+    """the SeedSequence of a run, the same as SeedSequence(base_seed).spawn(n)[spawn_key]"""
+    return np.random.SeedSequence(config["base_seed"], spawn_key=(config["spawn_key"],))
+
+
+def run_one(config, simulation_steps=simulation_steps, uranium_threshold_factor=threshold_factor_uranium, backend="numpy",
+            adaptive=False):
+    """runs a single config (in a worker process) and returns its metadata count curves"""
+    simulator = Simulation(simulation_steps, config["neutrons_start"], config["uranium_start"], backend=backend,
+                           bounding_parameter=config["bounding_parameter"], rng=np.random.default_rng(run_seed(config)),
+                           fission_prob_hardcoded_parameter=config["fission_prob_hardcoded_parameter"], adaptive=adaptive)
+    _, metadata = simulator.simulate(uranium_threshold=uranium_threshold_factor, sink=DiscardFrames()) # only the counts are aggregated
+    return config, metadata
+
+
+def _run_one_packed(job):
+    return run_one(*job)
+
+
+def run_ensemble(configs, simulation_steps=simulation_steps, uranium_threshold_factor=threshold_factor_uranium,
+                 workers=None, backend="numpy", adaptive=False):
+    """runs all configs on a process pool sized to the machine (one job per run), returns [(config, metadata)]"""
+    workers = workers or os.cpu_count() or 1
+    jobs = [(config, simulation_steps, uranium_threshold_factor, backend, adaptive) for config in configs]
+    if workers == 1:
+        return [_run_one_packed(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_run_one_packed, jobs))
+
+
+def time_to_threshold(uranium_counts, uranium_threshold_factor):
+    """first step at which the uranium count is at or below the threshold, None if never reached"""
+    counts = np.asarray(uranium_counts)
+    reached = np.flatnonzero(counts <= uranium_threshold_factor * counts[0])
+    return int(reached[0]) if len(reached) else None
+
+
+def _padded(curves, length):
+    # runs that stopped at the threshold keep their last count for the remaining steps
+    return np.array([np.pad(curve, (0, length - len(curve)), mode="edge") for curve in curves], dtype=np.float64)
+
+
+def summarize(curves, times):
+    """mean/quantile curves of {count_key: (replicas, steps) array} and the time-to-threshold
+    distribution of `times` (None for replicas that never reached it)"""
+    counts = {count_key: {
+        "mean": stacked.mean(axis=0).tolist(),
+        "quantiles": {str(q): values.tolist() for q, values in zip(QUANTILES, np.quantile(stacked, QUANTILES, axis=0))},
+    } for count_key, stacked in curves.items()}
+    reached = np.array([t for t in times if t is not None], dtype=np.float64)
+    return {
+        "counts": counts,
+        "time_to_threshold": {
+            "steps": list(times),
+            "reached_fraction": len(reached) / len(times),
+            "mean": float(reached.mean()) if len(reached) else None,
+            "quantiles": {str(q): float(v) for q, v in zip(QUANTILES, np.quantile(reached, QUANTILES))} if len(reached) else None,
+        },
+    }
+
+
+def aggregate(results, uranium_threshold_factor=threshold_factor_uranium):
+    """mean/quantile count curves and time-to-threshold distributions per grid point"""
+    groups = {}
+    for config, metadata in results:
+        key = tuple(config[k] for k in GRID_KEYS)
+        groups.setdefault(key, []).append((config, metadata))
+
+    summary = []
+    for key, runs in groups.items():
+        length = max(len(metadata["uranium_counts"]) for _, metadata in runs)
+        curves = {count_key: _padded([metadata[count_key] for _, metadata in runs], length) for count_key in COUNT_KEYS}
+        times = [time_to_threshold(metadata["uranium_counts"], uranium_threshold_factor) for _, metadata in runs]
+        summary.append({
+            "config": dict(zip(GRID_KEYS, key)),
+            "replicas": len(runs),
+            "spawn_keys": [config["spawn_key"] for config, _ in runs],
+            **summarize(curves, times),
+        })
+    return summary
+
+
+def _optional_float(value):
+    return None if value.lower() == "none" else float(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run an ensemble of simulations over a parameter grid.")
+    parser.add_argument("--uranium-start", type=int, nargs="+", default=[uranium_start])
+    parser.add_argument("--neutrons-start", type=int, nargs="+", default=[neutrons_start])
+    parser.add_argument("--bounding-parameter", type=float, nargs="+", default=[bounding_parameter])
+    parser.add_argument("--fission-prob", type=_optional_float, nargs="+", default=[fission_prob_hardcoded_parameter],
+                        help="hardcoded fission probabilities, 'none' for the cross-section formula")
+    parser.add_argument("--seeds", type=int, default=10, help="replicas per grid point")
+    parser.add_argument("--base-seed", type=int, default=0)
+    parser.add_argument("--steps", type=int, default=simulation_steps)
+    parser.add_argument("--threshold", type=float, default=threshold_factor_uranium)
+    parser.add_argument("--workers", type=int, default=None, help="default: number of cores")
+    parser.add_argument("--backend", choices=BACKENDS, default="numpy")
+    parser.add_argument("--adaptive", action="store_true", help="skip the contact search on quiet steps (sparse setups)")
+    parser.add_argument("--out", type=Path, default=None)
+    args = parser.parse_args(argv)
+    backend = resolve_backend(args.backend) # what the workers will run, also after a numba -> numpy fallback
+
+    configs = parameter_grid(args.uranium_start, args.neutrons_start, args.bounding_parameter, args.fission_prob,
+                             seeds=args.seeds, base_seed=args.base_seed)
+    start = time.perf_counter()
+    results = run_ensemble(configs, args.steps, args.threshold, workers=args.workers, backend=backend,
+                           adaptive=args.adaptive)
+    print(f"{len(results)} runs in {time.perf_counter() - start:.1f}s")
+
+    summary = {
+        "simulation_steps": args.steps,
+        "uranium_threshold_factor": args.threshold,
+        "base_seed": args.base_seed,
+        "backend": backend,
+        "groups": aggregate(results, args.threshold),
+    }
+    out = args.out or Path(__file__).resolve().parents[1] / "cached_runs" / "ensembles" / f"ensemble_{args.base_seed}_{int(time.time())}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with out.open("w", encoding="utf-8") as f:
+        json.dump(summary, f)
+    for group in summary["groups"]:
+        ttt = group["time_to_threshold"]
+        print(group["config"], f"reached={ttt['reached_fraction']:.2f}", f"mean_steps={ttt['mean']}")
+    print(f"Ensemble summary at {out}")
+
+
+if __name__ == "__main__":
+    main()
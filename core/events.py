@@ -0,0 +1,178 @@
+"""Fission event log: one record per split uranium, kept as columns and flushed to disk in batches.
+
+Columns (one file `<column>.bin` each in the log directory):
+    step             simulation step of the fission (1-based, index into the metadata count series)
+    neutron_id       id of the neutron that caused it
+    uranium_id       id of the uranium that got split
+    position         (3,) position of the uranium
+    v_dif            relative speed neutron - uranium
+    child_neutrons   (3,) ids of the new neutrons, -1 padded when only 2 were created
+    barium_id, krypton_id
+
+`generations` and `multiplication_factors` rebuild the neutron lineage from these records.
+"""
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+from core.snapshots import _write_json_atomic
+
+COLUMNS = {
+    "step": (np.int64, ()),
+    "neutron_id": (np.int64, ()),
+    "uranium_id": (np.int64, ()),
+    "position": (np.float64, (3,)),
+    "v_dif": (np.float64, ()),
+    "child_neutrons": (np.int64, (3,)),
+    "barium_id": (np.int64, ()),
+    "krypton_id": (np.int64, ()),
+}
+
+
+class FissionLog:
+    """Columnar buffer of fission events, appended to `directory` every `batch_size` events.
+
+    Without a directory all events stay in memory. append=True continues the log already in
+    `directory` (e.g. when resuming a simulation from a checkpoint) instead of starting over.
+    """
+
+    def __init__(self, directory=None, batch_size=4096, append=False):
+        self.directory = Path(directory) if directory is not None else None
+        self.batch_size = batch_size
+        self.count = 0 # events recorded so far
+        self._buffer = {name: np.empty((batch_size,) + shape, dtype=dtype) for name, (dtype, shape) in COLUMNS.items()}
+        self._buffered = 0
+        self._batches = [] # in-memory mode only
+
+        self._files = {}
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            if append and (self.directory / "manifest.json").exists():
+                with (self.directory / "manifest.json").open("r", encoding="utf-8") as f:
+                    self._cut(json.load(f)["events"]) # bytes of a batch that never made it into the manifest
+            self._files = {name: (self.directory / f"{name}.bin").open("ab" if append else "wb") for name in COLUMNS}
+            self._write_manifest()
+
+    def _write_manifest(self):
+        # replaced atomically, a run killed while writing it keeps the previous one (and stays resumable)
+        _write_json_atomic(self.directory / "manifest.json", {
+            "columns": {name: [np.dtype(dtype).str, list(shape)] for name, (dtype, shape) in COLUMNS.items()},
+            "events": self.count - self._buffered,
+        })
+
+    def record(self, step, **columns):
+        """append a batch of events, every column given as an array with one entry per event"""
+        count = len(columns["uranium_id"])
+        start = 0
+        while start < count:
+            take = min(count - start, self.batch_size - self._buffered)
+            for name in COLUMNS:
+                target = self._buffer[name][self._buffered:self._buffered + take]
+                if name == "step":
+                    target[...] = step
+                else:
+                    target[...] = np.asarray(columns[name])[start:start + take]
+            self._buffered += take
+            self.count += take
+            start += take
+            if self._buffered == self.batch_size:
+                self.flush()
+
+    def flush(self):
+        if not self._buffered:
+            return
+        batch = {name: column[:self._buffered].copy() for name, column in self._buffer.items()}
+        self._buffered = 0
+        if self.directory is None:
+            self._batches.append(batch)
+            return
+        for name, values in batch.items():
+            values.tofile(self._files[name])
+            self._files[name].flush()
+        self._write_manifest()
+
+    def _cut(self, events):
+        for name, (dtype, shape) in COLUMNS.items():
+            path = self.directory / f"{name}.bin"
+            if path.exists():
+                os.truncate(path, min(path.stat().st_size, events * np.dtype(dtype).itemsize * int(np.prod(shape))))
+        self.count = events
+
+    def truncate(self, events):
+        """drop everything after the first `events` events (nothing happens if there are fewer)"""
+        if self.count <= events:
+            return
+        self.flush()
+        if self.directory is None:
+            arrays = self.to_arrays()
+            self._batches = [{name: values[:events] for name, values in arrays.items()}]
+            self.count = events
+            return
+        for f in self._files.values():
+            f.flush()
+        self._cut(events)
+        self._write_manifest()
+
+    def close(self):
+        self.flush()
+        for f in self._files.values():
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def to_arrays(self):
+        """all events recorded so far as {column: array}"""
+        if self.directory is not None:
+            self.flush()
+            return load_fissions(self.directory)
+        batches = self._batches + [{name: column[:self._buffered] for name, column in self._buffer.items()}]
+        return {name: np.concatenate([batch[name] for batch in batches]) for name in COLUMNS}
+
+
+def load_fissions(directory):
+    """{column: array} of a fission log directory (only complete batches)"""
+    directory = Path(directory)
+    with (directory / "manifest.json").open("r", encoding="utf-8") as f:
+        events = json.load(f)["events"]
+    arrays = {}
+    for name, (dtype, shape) in COLUMNS.items():
+        width = int(np.prod(shape)) if shape else 1
+        values = np.fromfile(directory / f"{name}.bin", dtype=dtype, count=events * width)
+        arrays[name] = values.reshape((events,) + shape)
+    return arrays
+
+
+def generations(events):
+    """Generation of the neutron behind every fission (initial neutrons are generation 0, their
+    children 1, ...) plus the lineage map {child neutron id: index of the fission that created it}."""
+    order = np.argsort(events["step"], kind="stable")
+    parent_event = {}
+    event_generation = np.zeros(len(order), dtype=np.int64)
+    for k in order: # one fission at a time, parents always split before their children
+        event_index = parent_event.get(int(events["neutron_id"][k]))
+        event_generation[k] = 0 if event_index is None else event_generation[event_index] + 1
+        for child in events["child_neutrons"][k]:
+            if child >= 0:
+                parent_event[int(child)] = k
+    return event_generation, parent_event
+
+
+def multiplication_factors(events, initial_neutrons):
+    """Effective multiplication factor per generation: k_g = neutrons born in generation g + 1 / neutrons of generation g.
+
+    The last generations are still in flight when a run stops, so their k is biased low.
+    """
+    event_generation, _ = generations(events)
+    if not len(event_generation):
+        return np.empty(0)
+    children = (events["child_neutrons"] >= 0).sum(axis=1)
+    born = np.bincount(event_generation, weights=children, minlength=event_generation.max() + 1)
+    neutrons = np.concatenate(([initial_neutrons], born[:-1]))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(neutrons > 0, born / neutrons, np.nan)
@@ -0,0 +1,236 @@
+"""Compiled step kernels for Simulation(backend="numba").
+
+numba is optional: without it `resolve_backend("numba")` warns and falls back to "numpy".
+The kernels do the same float operations in the same order as the numpy path.
+"""
+import warnings
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+from core.collisions import _class_horizon, _speed_bounds, _wall_times
+
+BACKENDS = ("python", "numpy", "numba")
+NUMBA_MAX_CELLS_PER_AXIS = 128  # dense cell table, bigger cells are still correct
+
+
+def resolve_backend(backend):
+    """validate a backend name, "numba" falls back to "numpy" when numba is not installed"""
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown backend {backend!r}, expected one of {BACKENDS}")
+    if backend == "numba" and numba is None:
+        warnings.warn("numba is not installed, falling back to the numpy backend", RuntimeWarning, stacklevel=3)
+        return "numpy"
+    return backend
+
+
+def _jit(function):
+    if numba is None:
+        return function
+    return numba.njit(cache=True)(function)
+
+
+@_jit
+def move_and_reflect(positions, velocities, cooldown, dt, bound):
+    """one timestep in space, reflection at the walls and cooldown decay for every particle"""
+    for p in range(positions.shape[0]):
+        for k in range(3):
+            positions[p, k] += velocities[p, k] * dt
+            if positions[p, k] > bound:
+                positions[p, k] = bound
+                velocities[p, k] *= -1
+            elif positions[p, k] < -bound:
+                positions[p, k] = -bound
+                velocities[p, k] *= -1
+        if cooldown[p] > 0:
+            cooldown[p] = max(cooldown[p] - dt, 0.0)
+
+
+@_jit
+def _cell_lists(positions, bound, cell_size):
+    """linked list of the particles in every cell at least cell_size wide: cells per axis, first
+    particle per cell, next particle in the same cell and cell coordinates of every particle"""
+    count = positions.shape[0]
+    cells_per_axis = min(max(int(2 * bound // cell_size), 1), NUMBA_MAX_CELLS_PER_AXIS)
+    cell_size = 2 * bound / cells_per_axis
+    head = np.full(cells_per_axis ** 3, -1, dtype=np.int64)
+    next_in_cell = np.empty(count, dtype=np.int64)
+    coords = np.empty((count, 3), dtype=np.int64)
+    for p in range(count):
+        for k in range(3):
+            c = int(np.floor((positions[p, k] + bound) / cell_size))
+            coords[p, k] = min(max(c, 0), cells_per_axis - 1)
+        cell = (coords[p, 0] * cells_per_axis + coords[p, 1]) * cells_per_axis + coords[p, 2]
+        next_in_cell[p] = head[cell]
+        head[cell] = p
+    return cells_per_axis, head, next_in_cell, coords
+
+
+@_jit
+def _cell_list_contacts(positions, radii, bound, cell_size, radius_multiplicator):
+    count = positions.shape[0]
+    cells_per_axis, head, next_in_cell, coords = _cell_lists(positions, bound, cell_size)
+
+    found = 0
+    pairs = np.empty((max(count, 16), 2), dtype=np.int64)
+    for p in range(count):
+        for dx in range(-1, 2):
+            cx = coords[p, 0] + dx
+            if cx < 0 or cx >= cells_per_axis:
+                continue
+            for dy in range(-1, 2):
+                cy = coords[p, 1] + dy
+                if cy < 0 or cy >= cells_per_axis:
+                    continue
+                for dz in range(-1, 2):
+                    cz = coords[p, 2] + dz
+                    if cz < 0 or cz >= cells_per_axis:
+                        continue
+                    q = head[(cx * cells_per_axis + cy) * cells_per_axis + cz]
+                    while q != -1:
+                        if q > p: # every pair once, from its lower index
+                            distance_sq = 0.0
+                            for k in range(3):
+                                d = positions[p, k] - positions[q, k]
+                                distance_sq += d * d
+                            collision_distance = (radii[p] + radii[q]) * radius_multiplicator
+                            if distance_sq <= collision_distance ** 2:
+                                if found == pairs.shape[0]:
+                                    grown = np.empty((2 * found, 2), dtype=np.int64)
+                                    grown[:found] = pairs
+                                    pairs = grown
+                                pairs[found, 0] = p
+                                pairs[found, 1] = q
+                                found += 1
+                        q = next_in_cell[q]
+    return pairs[:found]
+
+
+def find_contacts(positions, radii, bound, radius_multiplicator):
+    """compiled cell list search, same contacts and order as collisions.find_contacts"""
+    if len(positions) < 2:
+        return np.empty((0, 2), dtype=np.intp)
+    cell_size = 2 * radii.max() * radius_multiplicator
+    pairs = _cell_list_contacts(positions, radii, bound, cell_size, radius_multiplicator)
+    return pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))].astype(np.intp)
+
+
+@_jit
+def _approach_horizon(positions, velocities, radii, speeds, walls, bound, cell_size, radius_multiplicator):
+    """the pair part of collisions.contacts_and_horizon: earliest possible contact of the pairs
+    closer than cell_size that are not touching yet"""
+    count = positions.shape[0]
+    cells_per_axis, head, next_in_cell, coords = _cell_lists(positions, bound, cell_size)
+    horizon = np.inf
+    for p in range(count):
+        for dx in range(-1, 2):
+            cx = coords[p, 0] + dx
+            if cx < 0 or cx >= cells_per_axis:
+                continue
+            for dy in range(-1, 2):
+                cy = coords[p, 1] + dy
+                if cy < 0 or cy >= cells_per_axis:
+                    continue
+                for dz in range(-1, 2):
+                    cz = coords[p, 2] + dz
+                    if cz < 0 or cz >= cells_per_axis:
+                        continue
+                    q = head[(cx * cells_per_axis + cy) * cells_per_axis + cz]
+                    while q != -1:
+                        closing = speeds[p] + speeds[q]
+                        if q > p and closing > 0:
+                            a = 0.0
+                            b = 0.0
+                            distance_sq = 0.0
+                            for k in range(3):
+                                d = positions[p, k] - positions[q, k]
+                                v = velocities[p, k] - velocities[q, k]
+                                a += v * v
+                                b += d * v
+                                distance_sq += d * d
+                            cd = (radii[p] + radii[q]) * radius_multiplicator
+                            if distance_sq > cd ** 2:
+                                c = distance_sq - cd ** 2
+                                discriminant = b * b - a * c
+                                first_contact = np.inf
+                                if b < 0 and discriminant >= 0 and a > 0:
+                                    first_contact = (-b - np.sqrt(discriminant)) / a
+                                straight = min(walls[p], walls[q])
+                                if first_contact < straight:
+                                    horizon = min(horizon, first_contact)
+                                elif straight < np.inf:
+                                    gap_sq = 0.0
+                                    for k in range(3):
+                                        g = positions[p, k] - positions[q, k] + (velocities[p, k] - velocities[q, k]) * straight
+                                        gap_sq += g * g
+                                    horizon = min(horizon, straight + max(np.sqrt(gap_sq) - cd, 0.0) / closing)
+                        q = next_in_cell[q]
+    return horizon
+
+
+def contacts_and_horizon(positions, velocities, radii, mass, bound, radius_multiplicator, skin):
+    """compiled collisions.contacts_and_horizon, same contacts, same horizon up to rounding"""
+    if len(positions) < 2:
+        return np.empty((0, 2), dtype=np.intp), np.inf
+    contacts = find_contacts(positions, radii, bound, radius_multiplicator)
+    speeds, bouncing = _speed_bounds(velocities, mass, contacts)
+    cell_size = 2 * radii.max() * radius_multiplicator + skin
+    walls = _wall_times(positions, velocities, bound)
+    walls[bouncing] = 0 # no straight line for these
+    horizon = min(_class_horizon(radii, speeds, cell_size, radius_multiplicator),
+                  _approach_horizon(positions, velocities, radii, speeds, walls, bound, cell_size, radius_multiplicator))
+    return contacts, horizon
+
+
+@_jit
+def resolve_contacts(contacts, draws, types, mass, velocities, cooldown, interaction_cooldown, fission_prob,
+                     table, log_min, per_log, slopes, neutron, uranium, deleted):
+    """The contacts of a step one by one in nested-loop order, like the rounds of Simulation._resolve_contacts.
+    A neutron-uranium contact splits if draws[k] < fission_prob (< 0: the cross-section table at
+    the relative speed, see cross_section.CrossSectionTable), the uranium is marked `deleted`;
+    everything else bounces. Returns the indices of the splitting contacts, the velocities of
+    their two particles at that moment (n, 2, 3) and the number of bounces."""
+    count = contacts.shape[0]
+    fissions = np.empty(count, dtype=np.int64)
+    speeds = np.empty((count, 2, 3))
+    splits = 0
+    bounces = 0
+    for k in range(count):
+        a, b = contacts[k, 0], contacts[k, 1]
+        if cooldown[a] == deleted or cooldown[b] == deleted:
+            continue
+        if not (cooldown[a] == 0 or cooldown[a] != cooldown[b]):
+            continue
+        if (types[a] == neutron and types[b] == uranium) or (types[a] == uranium and types[b] == neutron):
+            probability = fission_prob
+            if probability < 0:
+                d0 = velocities[a, 0] - velocities[b, 0]
+                d1 = velocities[a, 1] - velocities[b, 1]
+                d2 = velocities[a, 2] - velocities[b, 2]
+                v_dif = np.sqrt(d0 * d0 + d1 * d1 + d2 * d2)
+                probability = 0.0
+                if v_dif > 0:
+                    position = min(max((np.log(v_dif) - log_min) * per_log, 0.0), table.shape[0] - 1.0)
+                    index = int(position)
+                    probability = table[index] + (position - index) * slopes[index]
+            if draws[k] < probability:
+                fissions[splits] = k
+                speeds[splits, 0] = velocities[a]
+                speeds[splits, 1] = velocities[b]
+                splits += 1
+                cooldown[a if types[a] == uranium else b] = deleted
+                continue
+        m1, m2 = mass[a], mass[b]
+        for d in range(3):
+            v1, v2 = velocities[a, d], velocities[b, d]
+            velocities[a, d] = (m1 - m2) / (m1 + m2) * v1 + (2 * m2) / (m1 + m2) * v2
+            velocities[b, d] = (2 * m1) / (m1 + m2) * v1 + (m2 - m1) / (m1 + m2) * v2
+        cooldown[a] = interaction_cooldown
+        cooldown[b] = interaction_cooldown
+        bounces += 1
+    return fissions[:splits], speeds[:splits], bounces
+
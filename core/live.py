@@ -0,0 +1,199 @@
+"""Simulation in a background process that publishes its latest frame through shared memory.
+
+The producer writes every frame into the next slot of a FrameRing, a renderer reads only the newest
+one whenever it is ready, so simulation speed and render rate are independent and a slow renderer
+simply skips frames.
+"""
+import multiprocessing as mp
+import queue
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from core.particles import TYPES
+from core.simulation import Simulation
+
+HEADER_FIELDS = 2 # latest sequence number, done flag
+SLOT_FIELDS = 3 + len(TYPES) # sequence number, particle count, step, per-type counts
+
+
+class FrameRing:
+    """Ring buffer of frames (positions + type codes) in one shared memory block.
+
+    A slot is written first and announced afterwards by bumping the latest sequence number;
+    readers copy the slot and check its sequence number again, so a frame overwritten while
+    being copied is detected and read again (seqlock).
+    """
+
+    def __init__(self, memory, capacity, slots, owner):
+        self.memory = memory
+        self.capacity = capacity
+        self.slots = slots
+        self._owner = owner
+
+        offset = 0
+        self.header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=memory.buf, offset=offset)
+        offset += self.header.nbytes
+        self.slot_info = np.ndarray((slots, SLOT_FIELDS), dtype=np.int64, buffer=memory.buf, offset=offset)
+        offset += self.slot_info.nbytes
+        self.positions = np.ndarray((slots, capacity, 3), dtype=np.float32, buffer=memory.buf, offset=offset)
+        offset += self.positions.nbytes
+        self.type_codes = np.ndarray((slots, capacity), dtype=np.int8, buffer=memory.buf, offset=offset)
+
+    @staticmethod
+    def _size(capacity, slots):
+        return 8 * HEADER_FIELDS + 8 * slots * SLOT_FIELDS + slots * capacity * (3 * 4 + 1)
+
+    @classmethod
+    def create(cls, capacity, slots=4):
+        memory = shared_memory.SharedMemory(create=True, size=cls._size(capacity, slots))
+        ring = cls(memory, capacity, slots, owner=True)
+        ring.header[:] = (-1, 0)
+        ring.slot_info[:, 0] = -1
+        return ring
+
+    @classmethod
+    def attach(cls, name, capacity, slots):
+        return cls(shared_memory.SharedMemory(name=name), capacity, slots, owner=False)
+
+    @property
+    def spec(self):
+        """what another process needs for FrameRing.attach"""
+        return self.memory.name, self.capacity, self.slots
+
+    def publish(self, particles, step, counts):
+        sequence = int(self.header[0]) + 1
+        slot = sequence % self.slots
+        count = min(len(particles), self.capacity)
+
+        self.slot_info[slot, 0] = -1 # invalid while writing
+        self.positions[slot, :count] = particles.positions[:count]
+        self.type_codes[slot, :count] = particles.type_codes[:count]
+        self.slot_info[slot, 1:] = (count, step, *(counts[t] for t in TYPES))
+        self.slot_info[slot, 0] = sequence
+        self.header[0] = sequence
+
+    def latest(self, after=-1):
+        """newest frame as (sequence, positions, type codes, step, counts), None if nothing newer than `after`"""
+        while True:
+            sequence = int(self.header[0])
+            if sequence <= after:
+                return None
+            slot = sequence % self.slots
+            info = self.slot_info[slot].copy()
+            if info[0] != sequence: # being overwritten right now
+                continue
+            count = int(info[1])
+            positions = self.positions[slot, :count].copy()
+            type_codes = self.type_codes[slot, :count].copy()
+            if self.slot_info[slot, 0] == sequence:
+                counts = dict(zip(TYPES, (int(c) for c in info[3:])))
+                return sequence, positions, type_codes, int(info[2]), counts
+
+    def mark_done(self):
+        self.header[1] = 1
+
+    @property
+    def done(self):
+        return bool(self.header[1])
+
+    def close(self):
+        # drop the numpy views before the buffer goes away
+        self.header = self.slot_info = self.positions = self.type_codes = None
+        self.memory.close()
+        if self._owner:
+            self.memory.unlink()
+
+
+def _simulation_worker(ring_spec, simulation_kwargs, uranium_threshold_factor, steps_per_second, results, stop):
+    ring = FrameRing.attach(*ring_spec)
+    simulator = metadata = None
+    try:
+        simulator = Simulation(**simulation_kwargs)
+        particles = simulator._innitialize_particles()
+        metadata = simulator.new_metadata(particles)
+        ring.publish(particles, 0, particles.counts())
+
+        start = time.perf_counter()
+        for step in range(1, simulator.simulation_steps + 1):
+            if stop.is_set():
+                break
+            simulator.one_simulation_step(particles, metadata)
+            ring.publish(particles, step, particles.counts())
+
+            if metadata["uranium_counts"][-1] <= uranium_threshold_factor * metadata["uranium_counts"][0]:
+                break
+            if steps_per_second: # optional pacing, otherwise as fast as possible
+                delay = start + step / steps_per_second - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+    finally:
+        # also when the simulation fails: the window stops waiting and gets the counts so far (None if there are none)
+        if simulator is not None:
+            simulator.close()
+        ring.mark_done()
+        results.put(metadata)
+        ring.close()
+
+
+class LiveSimulation:
+    """Runs a Simulation in a separate process, `latest()` returns its newest frame.
+
+    steps_per_second=None lets the simulation run as fast as it can.
+    """
+
+    def __init__(self, simulation_steps, neutrons_start, uranium_start, uranium_threshold_factor=0.0,
+                 steps_per_second=None, slots=4, **simulation_kwargs):
+        self.simulation_steps = simulation_steps
+        # every uranium turns into at most 3 neutrons + barium + krypton, so the store never outgrows this
+        capacity = neutrons_start + 5 * uranium_start
+        self.ring = FrameRing.create(capacity, slots)
+        self._results = mp.Queue()
+        self._stop = mp.Event()
+        self._metadata = None
+        self._received = False # the worker sends exactly once, None included
+        self._last_sequence = -1
+        kwargs = dict(simulation_steps=simulation_steps, neutrons_start=neutrons_start, uranium_start=uranium_start,
+                      **simulation_kwargs)
+        self.process = mp.Process(target=_simulation_worker, daemon=True,
+                                  args=(self.ring.spec, kwargs, uranium_threshold_factor, steps_per_second, self._results, self._stop))
+
+    def start(self):
+        self.process.start()
+        return self
+
+    def latest(self):
+        """newest unseen frame as (positions, type codes, step, counts), None if there is none"""
+        frame = self.ring.latest(self._last_sequence)
+        if frame is None:
+            return None
+        self._last_sequence = frame[0]
+        return frame[1:]
+
+    @property
+    def done(self):
+        return self.ring.done and self.ring.latest(self._last_sequence) is None
+
+    def metadata(self, timeout=None):
+        """count series of the whole run, available once the worker finished (None if it failed before the first step)"""
+        if not self._received:
+            try:
+                self._metadata = self._results.get(timeout=timeout)
+            except queue.Empty:
+                return None
+            self._received = True
+        return self._metadata
+
+    def stop(self):
+        self._stop.set()
+        if self.process.is_alive():
+            self.metadata(timeout=5)
+            self.process.join(timeout=5)
+        self.ring.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
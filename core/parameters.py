@@ -12,6 +12,7 @@ fission_prob_hardcoded_parameter = 0.1
 simulation_speed = 2*10**-8  # smaller -> more precise (+ latency)
 interaction_cooldown_parameter = simulation_speed * 100 # parameter for how long a particle has to wait until it can interact again. debuggung purposes only
 threshold_factor_uranium = 0.03
+adaptive_skin = 3 # extra search distance of the adaptive stepper: larger -> longer skips but more candidate pairs
 
 radius_multiplicator = 10**10   # same effect as "pressing" everything tighter together
 speed_magnitude_new_products = 1.5 * 10**6
@@ -27,4 +28,6 @@ sigma_0 = 580  # Fission cross-section for thermal neutrons in barns
 sigma_thermal = 580  # Maximum fission cross-section for thermal neutrons in barns
 E_0 = 0.025  # Reference energy in eV (typical for thermal neutrons)
 alpha = 0.8  # Empirical constant (typically between 0.5 and 1)
+cross_section_points = 4096 # size of the tabulated probability (fission_prob_hardcoded_parameter = None uses it)
+cross_section_max_speed = 10**9 # relative speeds above this get the probability at this speed
 
@@ -1,41 +1,278 @@
 import numpy as np
-import uuid
 from core.parameters import simulation_speed, interaction_cooldown_parameter
 
+TYPES = ("neutron", "uranium_235", "barium", "krypton")
+TYPE_CODES = {t: code for code, t in enumerate(TYPES)}
+NEUTRON, URANIUM_235, BARIUM, KRYPTON = range(len(TYPES))
+
+DELETED = -1.0  # cooldown value of a particle that got split and waits for removal
+
+
+def elastic_collision(m1, m2, v1, v2):
+    """new speeds after an elastic collision (works on single vectors and on (n,3) batches)"""
+    v1_new = (m1 - m2) / (m1 + m2) * v1 + (2 * m2) / (m1 + m2) * v2
+    v2_new = (2 * m1) / (m1 + m2) * v1 + (m2 - m1) / (m1 + m2) * v2
+    return v1_new, v2_new
+
+
+class ParticleStore:
+    """All particles of a simulation as contiguous arrays (one row per particle).
+
+    The public arrays are views on the first `size` rows of preallocated buffers,
+    so they have to be re-read after `add` / `remove`. Per-type counts are kept up to date
+    by `add` / `remove`, so reading them never scans the particles.
+    """
+
+    def __init__(self, capacity=1024):
+        capacity = max(int(capacity), 1)
+        self.size = 0
+        self.next_id = 0  # ids are never reused
+
+        self._positions = np.empty((capacity, 3), dtype=np.float64)
+        self._velocities = np.empty((capacity, 3), dtype=np.float64)
+        self._mass = np.empty(capacity, dtype=np.float64)
+        self._radius = np.empty(capacity, dtype=np.float64)
+        self._cooldown = np.empty(capacity, dtype=np.float64)
+        self._type_codes = np.empty(capacity, dtype=np.int8)
+        self._ids = np.empty(capacity, dtype=np.int64)
+        self._type_counts = np.zeros(len(TYPES), dtype=np.int64)
+
+    def _buffers(self):
+        return (self._positions, self._velocities, self._mass, self._radius,
+                self._cooldown, self._type_codes, self._ids)
+
+    @property
+    def capacity(self):
+        return len(self._ids)
+
+    @property
+    def positions(self):
+        return self._positions[:self.size]
+
+    @property
+    def velocities(self):
+        return self._velocities[:self.size]
+
+    @property
+    def mass(self):
+        return self._mass[:self.size]
+
+    @property
+    def radius(self):
+        return self._radius[:self.size]
+
+    @property
+    def cooldown(self):
+        return self._cooldown[:self.size]
+
+    @property
+    def type_codes(self):
+        return self._type_codes[:self.size]
+
+    @property
+    def ids(self):
+        return self._ids[:self.size]
+
+    @property
+    def type_counts(self):
+        """number of stored particles per type code (read only)"""
+        counts = self._type_counts.view()
+        counts.flags.writeable = False
+        return counts
+
+    def state(self):
+        """{name: array} copy of the stored rows plus next_id, see from_state"""
+        return {
+            "positions": self.positions.copy(), "velocities": self.velocities.copy(), "mass": self.mass.copy(),
+            "radius": self.radius.copy(), "cooldown": self.cooldown.copy(), "type_codes": self.type_codes.copy(),
+            "ids": self.ids.copy(), "next_id": np.int64(self.next_id),
+        }
+
+    @classmethod
+    def from_state(cls, state, capacity=None):
+        """store holding exactly the rows of `state` (same order, ids and next_id)"""
+        size = len(state["ids"])
+        store = cls(max(size, capacity or 0))
+        (store._positions[:size], store._velocities[:size], store._mass[:size], store._radius[:size],
+         store._cooldown[:size], store._type_codes[:size], store._ids[:size]) = (
+            state["positions"], state["velocities"], state["mass"], state["radius"],
+            state["cooldown"], state["type_codes"], state["ids"])
+        store.size = size
+        store.next_id = int(state["next_id"])
+        store._type_counts[:] = np.bincount(store.type_codes, minlength=len(TYPES))
+        return store
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if not -self.size <= index < self.size:
+            raise IndexError(index)
+        return Particle.view(self, index % self.size)
+
+    def __iter__(self):
+        for index in range(self.size):
+            yield Particle.view(self, index)
+
+    def reserve(self, extra):
+        """make room for `extra` more particles (grows the buffers by doubling)"""
+        needed = self.size + extra
+        if needed <= self.capacity:
+            return
+        new_capacity = max(needed, 2 * self.capacity)
+        (self._positions, self._velocities, self._mass, self._radius,
+         self._cooldown, self._type_codes, self._ids) = [
+            self._grow(buffer, new_capacity) for buffer in self._buffers()
+        ]
+
+    def _grow(self, buffer, new_capacity):
+        grown = np.empty((new_capacity,) + buffer.shape[1:], dtype=buffer.dtype)
+        grown[:self.size] = buffer[:self.size]
+        return grown
+
+    def allocate_ids(self, count):
+        """reserve `count` fresh ids, e.g. to know the ids of particles before they are added"""
+        ids = np.arange(self.next_id, self.next_id + count, dtype=np.int64)
+        self.next_id += count
+        return ids
+
+    def add(self, type_code, positions, velocities, mass, radius, ids=None, cooldown=interaction_cooldown_parameter):
+        """append particles of one type (with fresh ids unless given), returns the indices of the new rows"""
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        count = len(positions)
+        self.reserve(count)
+
+        start, end = self.size, self.size + count
+        self._positions[start:end] = positions
+        self._velocities[start:end] = np.asarray(velocities, dtype=np.float64).reshape(-1, 3)
+        self._mass[start:end] = mass
+        self._radius[start:end] = radius
+        self._cooldown[start:end] = cooldown
+        self._type_codes[start:end] = type_code
+        self._ids[start:end] = self.allocate_ids(count) if ids is None else ids
+
+        self.size = end
+        self._type_counts[type_code] += count
+        return np.arange(start, end)
+
+    def remove(self, indices, keep_order=False):
+        """Drop rows. By default the holes are filled with the last rows (swap-remove), which costs
+        O(len(indices)) instead of O(size) but moves those rows; keep_order=True compacts instead."""
+        indices = np.unique(np.asarray(indices, dtype=np.intp))
+        if indices.size == 0:
+            return
+        self._type_counts -= np.bincount(self._type_codes[indices], minlength=len(TYPES))
+        remaining = self.size - len(indices)
+
+        if keep_order:
+            keep = np.ones(self.size, dtype=bool)
+            keep[indices] = False
+            for buffer in self._buffers():
+                buffer[:remaining] = buffer[:self.size][keep]
+        else:
+            holes = indices[indices < remaining]
+            tail = np.ones(self.size - remaining, dtype=bool) # rows behind the new end that survive
+            tail[indices[indices >= remaining] - remaining] = False
+            movers = remaining + np.flatnonzero(tail)
+            for buffer in self._buffers():
+                buffer[holes] = buffer[movers]
+        self.size = remaining
+
+    def forward(self, dt=simulation_speed):
+        """one timestep in space for every particle, plus cooldown decay"""
+        self.positions[...] += self.velocities * dt
+
+        cooldown = self.cooldown
+        cooling = cooldown > 0
+        cooldown[cooling] = np.maximum(cooldown[cooling] - dt, 0)  # ensure cooldown doesn't go below 0
+
+    def reflect(self, bound):
+        """reflect and clamp at the walls of the box [-bound, bound]^3"""
+        positions = self.positions
+        velocities = self.velocities
+
+        outside = (positions > bound) | (positions < -bound)
+        np.clip(positions, -bound, bound, out=positions)
+        velocities[outside] *= -1
+
+    def counts(self):
+        """number of stored particles per type name (split uranium counts until it is removed)"""
+        return {t: int(self._type_counts[code]) for code, t in enumerate(TYPES)}
+
 
 class Particle:
+    """Single particle view on one row of a ParticleStore (kept for compatibility).
+
+    A view is only valid until its store is compacted by `ParticleStore.remove`.
+    """
+
     def __init__(self, type: str, speed, position, mass: float, radius: float): # Mass: kg
-        self.id = str(uuid.uuid4())
+        store = ParticleStore(capacity=1)
+        store.add(TYPE_CODES[type], position, speed, mass, radius)
+        self._store = store
+        self._index = 0
 
-        self.type = type  # 'neutron', 'uranium_235' etc.
-        self.mass = mass
-        self.radius = radius
-        self.position = np.array(position, dtype=np.float64) # int -> float
-        self.speed = np.array(speed, dtype=np.float64)
+    @classmethod
+    def view(cls, store, index):
+        particle = cls.__new__(cls)
+        particle._store = store
+        particle._index = index
+        return particle
 
-        self.cooldown = interaction_cooldown_parameter
+    @property
+    def id(self):
+        return int(self._store.ids[self._index])
+
+    @property
+    def type(self):
+        return TYPES[self._store.type_codes[self._index]]
+
+    @property
+    def mass(self):
+        return float(self._store.mass[self._index])
+
+    @property
+    def radius(self):
+        return float(self._store.radius[self._index])
+
+    @property
+    def position(self):
+        return self._store.positions[self._index]
+
+    @position.setter
+    def position(self, value):
+        self._store.positions[self._index] = value
+
+    @property
+    def speed(self):
+        return self._store.velocities[self._index]
+
+    @speed.setter
+    def speed(self, value):
+        self._store.velocities[self._index] = value
+
+    @property
+    def cooldown(self):
+        return float(self._store.cooldown[self._index])
+
+    @cooldown.setter
+    def cooldown(self, value):
+        self._store.cooldown[self._index] = value
+
+    def _same_as(self, other_particle):
+        return self._store is other_particle._store and self._index == other_particle._index
 
     def distance(self, other_particle):
-        if self.id == other_particle.id:  # Check based on unique random ID
+        if self._same_as(other_particle):
             return -1.0
-        distance = np.linalg.norm(self.position - other_particle.position)
-        return distance
+        return float(np.linalg.norm(self.position - other_particle.position))
 
     def collision_interact(self, other_particle):
-        if self.id == other_particle.id: # to avoid interaction with itself (redundant with code in simulation)
+        if self._same_as(other_particle): # to avoid interaction with itself
             return self
 
         self.cooldown = interaction_cooldown_parameter # to avoid endless interactions
-
-        # attributes of particles
-        m1 = self.mass
-        m2 = other_particle.mass
-        v1 = self.speed
-        v2 = other_particle.speed
-
-        # Apply the collision formula
-        v1_new = (m1 - m2) / (m1 + m2) * v1 + (2 * m2) / (m1 + m2) * v2
-        v2_new = (2 * m1) / (m1 + m2) * v1 + (m2 - m1) / (m1 + m2) * v2
+        v1_new, v2_new = elastic_collision(self.mass, other_particle.mass, self.speed, other_particle.speed)
 
         # Update speeds and cooldown
         self.speed = v1_new
@@ -43,19 +280,13 @@ class Particle:
 
         return self
 
-
     def update(self, speed): # updating attributes if other particle bumps into me
         self.speed = speed
         self.cooldown = interaction_cooldown_parameter
 
-
     def forward(self):
         """one timestep"""
-        # one step in space
         self.position += self.speed * simulation_speed
 
         if self.cooldown > 0:
-            self.cooldown -= simulation_speed
-            if self.cooldown < 0:
-                self.cooldown = 0  # ensure cooldown doesn't go below 0
-
+            self.cooldown = max(self.cooldown - simulation_speed, 0)  # ensure cooldown doesn't go below 0
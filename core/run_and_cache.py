@@ -1,76 +1,116 @@
+import argparse
 import json
-from pathlib import Path
 
 import numpy as np
 
 from core.parameters import (
     bounding_parameter,
-    fission_prob_hardcoded_parameter,
     neutrons_start,
     threshold_factor_uranium,
     uranium_start,
     simulation_steps,
 )
 
+from core.events import FissionLog
+from core.kernels import BACKENDS, resolve_backend
+from core.run_cache import RunCache, parameter_set
 from core.simulation import Simulation
+from core.snapshots import SnapshotWriter
+from core.telemetry import Telemetry
 
-TYPES = ("neutron", "uranium_235", "barium", "krypton")
+PRECISIONS = {"float32": np.float32, "float16": np.float16, "int16": np.int16}
 
-def _create_folder_name():
-    base_dir = Path(__file__).resolve().parents[1] / "cached_runs"
-    return base_dir / (
-        f"{uranium_start}_{neutrons_start}_{bounding_parameter}_{fission_prob_hardcoded_parameter}"
-    )
 
-def run_and_cache(simulation_steps, uranium_threshold_factor):
-    simulator = Simulation(simulation_steps, neutrons_start, uranium_start)
-
-    snapshots, metadata = simulator.simulate(uranium_threshold=uranium_threshold_factor)
-
-    dir_name = _create_folder_name()
-    dir_name.mkdir(parents=True, exist_ok=True) # create dir
-
-    pos_blocks = {t: [] for t in TYPES} # dict containing lists of snapshots (in np array format)
-    offsets = {t: [0] for t in TYPES} # caching start/end of each snapshot
-
-    for snapshot in snapshots:
-        for t in TYPES:
-            arr = np.asarray(snapshot.get(t, []), dtype=np.float32)
-            if arr.size == 0:
-                arr = np.empty((0, 3), dtype=np.float32)
-            pos_blocks[t].append(arr)
-            offsets[t].append(offsets[t][-1] + len(arr)) # caching start/end of each snapshot
-
-
-    payload = {}
-    for t in TYPES:
-        if offsets[t][-1]:
-            payload[f"{t}_pos"] = np.concatenate(pos_blocks[t], axis=0)
-        else:
-            payload[f"{t}_pos"] = np.empty((0, 3), dtype=np.float32)
-        payload[f"{t}_offsets"] = np.asarray(offsets[t], dtype=np.int32)
-
-    np.savez_compressed(dir_name / "snapshots.npz", **payload)
-    with (dir_name / "metadata.json").open("w", encoding="utf-8") as f:
-        json.dump(metadata, f)
-
-
-
-
-    # cache parameters as json
-    run_config = {
+def run_config(simulation_steps, uranium_threshold_factor, seed=0, every=1, keyframe_interval=None, tolerance=0.0,
+               precision="float32", compression=None, backend="numpy"):
+    """everything that determines the cached result: all of core.parameters plus the run and snapshot options
+    and the backend (python and the batched backends draw their random numbers differently)"""
+    config = parameter_set()
+    config.update({
         "simulation_steps": simulation_steps,
         "uranium_threshold_factor": uranium_threshold_factor,
-        "uranium_start": uranium_start,
-        "neutrons_start": neutrons_start,
-        "bounding_parameter": bounding_parameter,
-        "fission_prob_hardcoded_parameter": fission_prob_hardcoded_parameter,
-    }
-    with (dir_name / "run_config.json").open("w", encoding="utf-8") as f:
-        json.dump(run_config, f)
-
-    print(f"Cached snapshots at {dir_name}")
+        "seed": seed,
+        "every": every,
+        "keyframe_interval": keyframe_interval,
+        "tolerance": tolerance,
+        "precision": precision,
+        "compression": compression,
+        "backend": backend,
+    })
+    return config
+
+
+def run_and_cache(simulation_steps, uranium_threshold_factor, every=1, keyframe_interval=None, tolerance=0.0,
+                  precision="float32", compression=None, adaptive=False, telemetry=True, seed=0, force=False,
+                  cache=None, max_cache_bytes=None, workers=None, backend="numpy"):
+    """Runs one simulation and caches it, returns the run directory. A run with the same config
+    (see run_config) and code is returned right away unless `force`.
+    The snapshot options are described in core.snapshots, adaptive and workers don't change the results.
+    backend: see Simulation, numpy and numba give the same results but are cached separately
+    telemetry: also write time per phase and counters per step to telemetry.json
+    max_cache_bytes: evict least recently used runs afterwards to stay below this size"""
+    cache = cache or RunCache()
+    backend = resolve_backend(backend) # a numba run without numba is a numpy run
+    config = run_config(simulation_steps, uranium_threshold_factor, seed, every, keyframe_interval, tolerance,
+                        precision, compression, backend)
+    cached = None if force else cache.get(config)
+    if cached is not None:
+        print(f"Using cached run at {cached}")
+        return cached
+    if force and cache.key(config) in cache.entries():
+        cache.remove(cache.key(config))
+
+    with cache.build(config) as dir_name:
+        fission_log = FissionLog(dir_name / "fissions")
+        telemetry = Telemetry() if telemetry else None
+        simulator = Simulation(simulation_steps, neutrons_start, uranium_start, backend=backend, fission_log=fission_log,
+                               adaptive=adaptive, telemetry=telemetry, seed=seed, workers=workers)
+
+        # frames stream to disk in chunks while the simulation runs
+        with fission_log, SnapshotWriter(dir_name / "snapshots", dtype=PRECISIONS[precision], compression=compression, every=every,
+                            keyframe_interval=keyframe_interval, tolerance=tolerance, bound=bounding_parameter) as writer:
+            _, metadata = simulator.simulate(uranium_threshold=uranium_threshold_factor, sink=writer)
+
+        with (dir_name / "metadata.json").open("w", encoding="utf-8") as f:
+            json.dump(metadata.to_dict(), f)
+        if telemetry is not None:
+            telemetry.save(dir_name / "telemetry.json")
+
+        # cache parameters as json
+        with (dir_name / "run_config.json").open("w", encoding="utf-8") as f:
+            json.dump(config, f)
+
+    run_dir = cache.path(cache.key(config))
+    if max_cache_bytes is not None:
+        cache.evict(max_bytes=max_cache_bytes, keep=(run_dir.name,))
+    print(f"Cached snapshots at {run_dir}")
+    return run_dir
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the simulation from core.parameters and cache its snapshots.")
+    parser.add_argument("--every", type=int, default=1, help="keep every k-th frame")
+    parser.add_argument("--keyframe-interval", type=int, default=None, help="full frame every n stored frames, deltas in between")
+    parser.add_argument("--tolerance", type=float, default=0.0, help="delta frames skip particles that moved less than this")
+    parser.add_argument("--precision", choices=sorted(PRECISIONS), default="float32")
+    parser.add_argument("--compression", choices=["zlib"], default=None)
+    parser.add_argument("--backend", choices=BACKENDS, default="numpy")
+    parser.add_argument("--adaptive", action="store_true", help="skip the contact search on quiet steps (sparse setups)")
+    parser.add_argument("--workers", type=int, default=None, help="split the contact search over this many processes")
+    parser.add_argument("--no-telemetry", dest="telemetry", action="store_false", help="don't write telemetry.json")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--force", action="store_true", help="run again even if the run is cached")
+    parser.add_argument("--max-cache-gb", type=float, default=None, help="evict least recently used runs beyond this size")
+    args = parser.parse_args(argv)
+    if args.adaptive and args.workers:
+        parser.error("--adaptive and --workers can't be combined")
+
+    run_and_cache(simulation_steps, threshold_factor_uranium, every=args.every, keyframe_interval=args.keyframe_interval,
+                  tolerance=args.tolerance, precision=args.precision, compression=args.compression,
+                  adaptive=args.adaptive, telemetry=args.telemetry, seed=args.seed, force=args.force, workers=args.workers,
+                  backend=args.backend,
+                  max_cache_bytes=None if args.max_cache_gb is None else args.max_cache_gb * 1e9)
 
 
 if __name__ == "__main__":
-    run_and_cache(simulation_steps, threshold_factor_uranium)
+    main()
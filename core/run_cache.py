@@ -0,0 +1,252 @@
+"""Content-addressed cache of simulation runs.
+
+A run is stored under cached_runs/runs/<key>/, the key hashes the complete configuration (every
+constant of core.parameters, the run options and the seed) together with the version of the
+simulation code in core/ (RESULT_MODULES). A run is built in cached_runs/tmp/ and renamed into place when it is complete,
+so a crashed run never shows up as cached. A failed or interrupted build stays in tmp/ to be looked
+at; `list` shows it and `evict` drops it once no process is writing it. cached_runs/index.json lists all runs with their
+config, size and last use, which is what LRU / size-based eviction works on. Finished runs are
+also added to cached_runs/catalog.sqlite (and dropped from it with the run), see core.catalog.
+
+    python -m core.run_cache list
+    python -m core.run_cache evict --max-gb 20 [--max-runs 50]
+    python -m core.run_cache remove <key>
+"""
+import argparse
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+from pathlib import Path
+
+from core import parameters
+from core.catalog import Catalog
+from core.snapshots import _write_json_atomic
+
+CACHE_ROOT = Path(__file__).resolve().parents[1] / "cached_runs"
+CODE_DIR = Path(__file__).resolve().parent
+RESULT_MODULES = ("simulation", "particles", "collisions", "kernels", "cross_section", "parameters", "snapshots", "events")
+KEY_PATTERN = re.compile(r"[0-9a-f]{20}") # cache_key
+BUILD_LOCK = ".building" # flock of the process writing a build in tmp/
+
+
+def parameter_set():
+    """every plain constant of core.parameters"""
+    return {name: value for name, value in sorted(vars(parameters).items())
+            if not name.startswith("_") and isinstance(value, (bool, int, float, str, type(None)))}
+
+
+def code_version():
+    """hash of the sources that shape what a run writes (RESULT_MODULES), changes whenever results could.
+    The cache, catalog, ensemble and viz code can change without invalidating the cached runs."""
+    digest = hashlib.sha256()
+    for name in RESULT_MODULES:
+        path = CODE_DIR / f"{name}.py"
+        digest.update(path.name.encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()[:16]
+
+
+def cache_key(config, version=None):
+    payload = json.dumps({"config": config, "code_version": version or code_version()}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:20]
+
+
+def _directory_size(path):
+    return sum(f.stat().st_size for f in Path(path).rglob("*") if f.is_file())
+
+
+def _is_locked(path):
+    """whether some process holds the flock on `path` (a missing file counts as unlocked)"""
+    try:
+        with path.open("r") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+            return False
+    except FileNotFoundError:
+        return False
+
+
+class RunCache:
+    """Index of cached runs below `root`, see the module docstring."""
+
+    def __init__(self, root=CACHE_ROOT):
+        self.root = Path(root)
+        self.runs = self.root / "runs"
+        self.tmp = self.root / "tmp"
+        self.index_path = self.root / "index.json"
+
+    @contextlib.contextmanager
+    def _locked_index(self):
+        """the index, exclusively locked; changes to it are written back atomically"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        with (self.root / "index.lock").open("w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            index = self._read_index()
+            yield index
+            _write_json_atomic(self.index_path, index)
+
+    def _read_index(self):
+        if not self.index_path.exists():
+            return {}
+        with self.index_path.open("r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def entries(self):
+        """{key: entry} of all cached runs"""
+        return self._read_index()
+
+    def catalog(self):
+        """the catalog of this cache (core.catalog), close it after use"""
+        return Catalog(root=self.root)
+
+    def key(self, config):
+        return cache_key(config)
+
+    def path(self, key):
+        return self.runs / key
+
+    def get(self, config):
+        """directory of the run cached for `config` (marked as used), None if there is none"""
+        key = cache_key(config)
+        if not self.path(key).is_dir():
+            return None
+        with self._locked_index() as index:
+            if key in index:
+                index[key]["last_used"] = time.time()
+        return self.path(key)
+
+    def find(self, **criteria):
+        """most recently used run whose config contains all `criteria` items, None if there is none"""
+        matches = [(entry["last_used"], key) for key, entry in self.entries().items()
+                   if all(entry["config"].get(name) == value for name, value in criteria.items())
+                   and self.path(key).is_dir()]
+        return self.path(max(matches)[1]) if matches else None
+
+    @contextlib.contextmanager
+    def build(self, config):
+        """Directory to write a new run into, moved into the cache when the block finishes
+        without an error. On an error or interrupt it stays in tmp/ (see partial_builds).
+        Yields the temporary directory."""
+        key = cache_key(config)
+        version = code_version()
+        work = self.tmp / f"{key}-{uuid.uuid4().hex[:8]}"
+        with self._locked_index(): # drop_stale_builds looks at tmp/ under the same lock
+            self.tmp.mkdir(parents=True, exist_ok=True)
+            work.mkdir()
+            lock = (work / BUILD_LOCK).open("w")
+            fcntl.flock(lock, fcntl.LOCK_EX) # held as long as this process writes the run
+        try:
+            yield work
+
+            self.runs.mkdir(parents=True, exist_ok=True)
+            with self._locked_index() as index:
+                os.remove(work / BUILD_LOCK)
+                if self.path(key).exists(): # another process finished the same run first
+                    shutil.rmtree(work, ignore_errors=True)
+                else:
+                    os.rename(work, self.path(key))
+                now = time.time()
+                index[key] = {"config": config, "code_version": version, "created": index.get(key, {}).get("created", now),
+                              "last_used": now, "bytes": _directory_size(self.path(key))}
+        finally:
+            lock.close()
+        with self.catalog() as catalog:
+            catalog.add(self.path(key))
+
+    def partial_builds(self):
+        """{directory: still being written} of the builds in tmp/ that never made it into the cache"""
+        builds = {}
+        for work in sorted(self.tmp.glob("*")) if self.tmp.is_dir() else ():
+            if work.is_dir():
+                builds[work] = _is_locked(work / BUILD_LOCK)
+        return builds
+
+    def drop_stale_builds(self):
+        """removes the partial builds no process is writing any more, returns their directory names"""
+        removed = []
+        with self._locked_index():
+            for work, active in self.partial_builds().items():
+                if not active:
+                    shutil.rmtree(work, ignore_errors=True)
+                    removed.append(work.name)
+        return removed
+
+    def remove(self, key):
+        """drops a cached run, ValueError for anything that is not the key of an indexed run"""
+        if not KEY_PATTERN.fullmatch(key):
+            raise ValueError(f"{key!r} is not a cache key")
+        with self._locked_index() as index:
+            if key not in index:
+                raise ValueError(f"no cached run {key}")
+            del index[key]
+            shutil.rmtree(self.path(key), ignore_errors=True)
+        with self.catalog() as catalog:
+            catalog.remove(key)
+
+    def evict(self, max_bytes=None, max_runs=None, keep=()):
+        """drops the stale partial builds and then the least recently used runs until both limits hold,
+        returns the removed keys"""
+        self.drop_stale_builds()
+        with self._locked_index() as index:
+            by_age = sorted(index, key=lambda key: index[key]["last_used"])
+            total = sum(entry["bytes"] for entry in index.values())
+            removed = []
+            for key in by_age:
+                if (max_bytes is None or total <= max_bytes) and (max_runs is None or len(index) <= max_runs):
+                    break
+                if key in keep:
+                    continue
+                total -= index[key]["bytes"]
+                del index[key]
+                shutil.rmtree(self.path(key), ignore_errors=True)
+                removed.append(key)
+        with self.catalog() as catalog:
+            catalog.remove(*removed)
+        return removed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect and trim the run cache.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="cached runs, most recently used last, then partial builds")
+    evict = commands.add_parser("evict", help="drop stale partial builds and least recently used runs")
+    evict.add_argument("--max-gb", type=float, default=None)
+    evict.add_argument("--max-runs", type=int, default=None)
+    remove = commands.add_parser("remove", help="drop one run")
+    remove.add_argument("key")
+    args = parser.parse_args(argv)
+
+    cache = RunCache()
+    if args.command == "list":
+        entries = cache.entries()
+        for key in sorted(entries, key=lambda key: entries[key]["last_used"]):
+            entry = entries[key]
+            config = entry["config"]
+            print(key, time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["last_used"])), f"{entry['bytes'] / 1e6:8.1f} MB",
+                  f"U={config.get('uranium_start')} n={config.get('neutrons_start')} steps={config.get('simulation_steps')} "
+                  f"seed={config.get('seed')}")
+        for work, active in cache.partial_builds().items():
+            print(f"tmp/{work.name}", f"{_directory_size(work) / 1e6:8.1f} MB", "building" if active else "stale, dropped by evict")
+    elif args.command == "evict":
+        max_bytes = None if args.max_gb is None else args.max_gb * 1e9
+        for name in cache.drop_stale_builds():
+            print(f"removed tmp/{name}")
+        for key in cache.evict(max_bytes, args.max_runs):
+            print(f"removed {key}")
+    else:
+        try:
+            cache.remove(args.key)
+        except ValueError as error:
+            raise SystemExit(str(error))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,106 @@
-from core.particles import Particle, simulation_speed
+from collections.abc import Mapping
+from core.particles import ParticleStore, elastic_collision, simulation_speed, interaction_cooldown_parameter, \
+    TYPES, NEUTRON, URANIUM_235, BARIUM, KRYPTON, DELETED
+from core.collisions import find_contacts, first_contacts, can_interact, brute_force_pairs, cell_list_pairs, contact_pairs, \
+    contacts_and_horizon
+from core import kernels
+from core.domains import DomainSearch
+from core.snapshots import SnapshotList
+from core.checkpoint import write_checkpoint, read_checkpoint, restore_random_state, checkpoint_particles
 import numpy as np
-import random
-from core.parameters import sigma_0, sigma_thermal, E_0, alpha, bounding_parameter, neutron_speed_magnitude, \
-    radius_multiplicator,simulation_steps, neutron_init_speed, fission_prob_hardcoded_parameter, speed_magnitude_new_products, uranium_start, neutrons_start
+from core.cross_section import cross_section_table
+from core.parameters import bounding_parameter, neutron_speed_magnitude, \
+    radius_multiplicator,simulation_steps, adaptive_skin, neutron_init_speed, fission_prob_hardcoded_parameter, speed_magnitude_new_products, uranium_start, neutrons_start
+
+PREALLOCATED_STEPS = 1 << 16 # count series grow by doubling beyond this
+
+SERIES = {"uranium_counts": URANIUM_235, "neutron_counts": NEUTRON, "barium_counts": BARIUM, "krypton_counts": KRYPTON}
+
+
+class CountSeries(Mapping):
+    """Metadata of a run: per-type counts of every step in one preallocated array.
+
+    metadata["uranium_counts"] etc. are views on the steps filled so far, `to_dict` gives plain lists (json).
+    """
+
+    def __init__(self, steps, initial_counts):
+        self._counts = np.zeros((steps + 1, len(TYPES)), dtype=np.int64)
+        self._counts[0] = initial_counts
+        self.length = 1
+
+    @classmethod
+    def from_counts(cls, counts, steps):
+        """series continuing from the (length, types) `counts` of an earlier run, room for `steps` steps in total"""
+        series = cls(max(steps, len(counts) - 1), counts[0])
+        series._counts[:len(counts)] = counts
+        series.length = len(counts)
+        return series
+
+    def append(self, counts):
+        """counts: one value per type code"""
+        if self.length == len(self._counts): # more steps than announced
+            self._counts = np.concatenate([self._counts, np.zeros_like(self._counts)])
+        self._counts[self.length] = counts
+        self.length += 1
+
+    def __getitem__(self, key):
+        return self._counts[:self.length, SERIES[key]]
+
+    def __iter__(self):
+        return iter(SERIES)
+
+    def __len__(self):
+        return len(SERIES)
+
+    def __getstate__(self):
+        return self._counts[:self.length], self.length # no unused rows when sent to another process
+
+    def __setstate__(self, state):
+        self._counts, self.length = state
+
+    def to_dict(self):
+        return {key: self[key].tolist() for key in SERIES}
+
 
 class Simulation:
 
-    def __init__(self, simulation_steps, neutrons_start, uranium_start):
+    def __init__(self, simulation_steps, neutrons_start, uranium_start, backend="numpy",
+                 bounding_parameter=bounding_parameter, fission_prob_hardcoded_parameter=fission_prob_hardcoded_parameter,
+                 fission_log=None, adaptive=False, skin=adaptive_skin, telemetry=None, seed=None, rng=None,
+                 workers=None):
+        """backend: "python" (per-pair reference path), "numpy" (batched, default) or "numba" (compiled kernels).
+        Box size and fission probability default to the values in core.parameters, a fission probability of
+        None uses the energy-dependent cross-section instead (core.cross_section).
+        fission_log: optional core.events.FissionLog that receives every fission.
+        adaptive: skip the contact search on steps that provably have no contact (see _find_contacts_adaptive),
+        the results stay the same as without. Meant for sparse setups, so it can't be combined with workers.
+        telemetry: optional core.telemetry.Telemetry that records time per phase and counters per step.
+        seed / rng: every random number of the run comes from `rng` (a np.random.Generator) or, without one, from
+        np.random.default_rng(seed); the same seed gives the same run, also next to other runs in one process.
+        workers: split the contact search over that many processes (core.domains), same results; call close()
+        (simulate does) to stop them. Adaptive runs keep their own search."""
         self.simulation_steps = simulation_steps
         self.neutrons_start = neutrons_start
         self.uranium_start = uranium_start
+        self.bounding_parameter = bounding_parameter
+        self.fission_prob_hardcoded_parameter = fission_prob_hardcoded_parameter
+        # None: the energy-dependent cross-section decides, tabulated once per parameter set
+        self.cross_section = cross_section_table() if fission_prob_hardcoded_parameter is None else None
+        self.fission_log = fission_log
+        self.adaptive = adaptive
+        self.telemetry = telemetry
+        self.skin = skin
+        self._step = 0
+        self._quiet_steps = 0 # adaptive: upcoming steps that can't have a contact
+        self.skipped_searches = 0
+        self.backend = kernels.resolve_backend(backend)
+        self.rng = rng if rng is not None else np.random.default_rng(seed)
+        if workers and self.backend == "python":
+            raise ValueError("workers need a batched backend (numpy or numba)")
+        if workers and adaptive:
+            raise ValueError("adaptive runs its full searches in this process, use it without workers")
+        self.workers = workers
+        self._domains = None
 
         # constants
         self.mass_neutron = 1.675 * 10 ** -27
@@ -24,206 +115,446 @@ class Simulation:
     def _innitialize_particles(self):
         """creating initial particles"""
 
-        particles = []
-
-        # instance particle objects of type neutron
-        for i in range(self.neutrons_start):
-            speed_mag = np.random.uniform(neutron_init_speed, 1.5* neutron_init_speed)
-            speed_vector = self.random_unit_vector() * speed_mag
-            position_vector = np.random.uniform(low = -bounding_parameter*0.9, high= bounding_parameter*0.9, size=3)
-            particles.append(Particle("neutron", speed_vector, position_vector, self.mass_neutron, self.radius_neutron))
-
+        particles = ParticleStore(capacity=2 * (self.neutrons_start + self.uranium_start))
 
-        # instance particle objects of type uranium
-        for i in range(self.uranium_start):
-            speed_mag = np.random.uniform(0, 100)
-            speed_vector = self.random_unit_vector() * speed_mag
-            position_vector = np.random.uniform(-bounding_parameter*0.9, bounding_parameter*0.9, 3)
-            particles.append(Particle("uranium_235", speed_vector, position_vector, self.mass_uranium_235, self.radius_uranium))
+        # all positions and speeds of a type in one draw each
+        rng = self.rng
+        speeds = self.random_unit_vectors(self.neutrons_start) * rng.uniform(neutron_init_speed, 1.5 * neutron_init_speed, (self.neutrons_start, 1))
+        positions = rng.uniform(-self.bounding_parameter * 0.9, self.bounding_parameter * 0.9, (self.neutrons_start, 3))
+        particles.add(NEUTRON, positions, speeds, self.mass_neutron, self.radius_neutron)
 
+        speeds = self.random_unit_vectors(self.uranium_start) * rng.uniform(0, 100, (self.uranium_start, 1))
+        positions = rng.uniform(-self.bounding_parameter * 0.9, self.bounding_parameter * 0.9, (self.uranium_start, 3))
+        particles.add(URANIUM_235, positions, speeds, self.mass_uranium_235, self.radius_uranium)
 
         return particles
 
     def random_unit_vector(self):
-        vec = np.random.normal(0.0, 1.0, 3)
+        vec = self.rng.normal(0.0, 1.0, 3)
         norm = np.linalg.norm(vec)
         if norm == 0:
             return np.array([1.0, 0.0, 0.0])
         return vec / norm
 
+    def random_unit_vectors(self, count):
+        """`count` random unit vectors as a (count, 3) array in one draw"""
+        vecs = self.rng.normal(0.0, 1.0, (count, 3))
+        norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+        return np.where(norms == 0, np.array([1.0, 0.0, 0.0]), vecs / np.where(norms == 0, 1, norms))
+
 
     def _fission_probability(self, v1, v2):
-        if v1.all() == v2.all():
-            return 0,0
+        """cross-section probability of one pair, 0 if both move alike"""
         v_dif = np.linalg.norm(v1 - v2)  # speed difference
-        probability = (sigma_0 / sigma_thermal) * (5.22e-2 * v_dif ** 2 / E_0) ** (-alpha)
-        return probability, v_dif
-
-
-
-    def _check_for_collision(self, particle, possible_neighbour):
-        if particle.cooldown == -1 or possible_neighbour.cooldown == -1: # no interaction if one is marked as deleted
-            return False
-
-        elif particle.cooldown == 0 or particle.cooldown != possible_neighbour.cooldown:  # particles have not just interacted, to avoid endless interactions or add and possible_neighbour.cooldown == 0
-            if particle.id == possible_neighbour.id: # redundant but secure
-                return False
-
-            displacement = particle.position - possible_neighbour.position
-            distance_sq = np.dot(displacement, displacement)
-            collision_distance = (particle.radius + possible_neighbour.radius) * radius_multiplicator
-
-            if distance_sq <= collision_distance ** 2:  # if two particles are very close -> interaction
-                return True
-
-            else: return False
+        return float(self.cross_section(v_dif)), v_dif
 
-        else: return False
+    def _fission_probabilities(self, v1, v2):
+        """_fission_probability for (n, 3) speed arrays, one table lookup for all pairs"""
+        v_dif = np.linalg.norm(v1 - v2, axis=1)
+        return self.cross_section(v_dif), v_dif
 
 
 
-    def _execute_collision_or_interaction(self, particle, possible_neighbour):
-        if (particle.type == "uranium_235" and possible_neighbour.type == "neutron") or (
-                particle.type == "neutron" and possible_neighbour.type == "uranium_235"):
-            fission_prob, v_dif = self._fission_probability(particle.speed, possible_neighbour.speed)
-            if fission_prob_hardcoded_parameter is not None:
-                fission_prob = fission_prob_hardcoded_parameter # for the simulation to work with fewer particles.
+    def _can_interact(self, cooldown, i, j):
+        if cooldown[i] == DELETED or cooldown[j] == DELETED: # no interaction if one is marked as deleted
+            return False
+        # particles have not just interacted, to avoid endless interactions
+        return cooldown[i] == 0 or cooldown[i] != cooldown[j]
+
+    def _collide(self, particles, i, j):
+        """elastic bounce of the pair (i, j)"""
+        velocities = particles.velocities
+        velocities[i], velocities[j] = elastic_collision(particles.mass[i], particles.mass[j], velocities[i], velocities[j])
+        particles.cooldown[i] = interaction_cooldown_parameter # to avoid endless interactions
+        particles.cooldown[j] = interaction_cooldown_parameter
+
+    def _execute_collision_or_interaction(self, particles, i, j, draws):
+        """returns the particles to spawn as (type, positions, speeds, mass, radius, ids) groups and the index of the split uranium.
+        draws: two uniform numbers for the fission test and 2 vs 3 neutrons"""
+        types = particles.type_codes
+        if (types[i] == URANIUM_235 and types[j] == NEUTRON) or (types[i] == NEUTRON and types[j] == URANIUM_235):
+            speed_i, speed_j = particles.velocities[i], particles.velocities[j]
+            if self.fission_prob_hardcoded_parameter is not None:
+                fission_prob = self.fission_prob_hardcoded_parameter # for the simulation to work with fewer particles.
+            else:
+                fission_prob, _ = self._fission_probability(speed_i, speed_j)
 
-            if random.random() < fission_prob:
+            if draws[0] < fission_prob:
 
                 # create 2-3 new neutrons <<<
                 a = 2
-                if random.random() < 0.5:
+                if draws[1] < 0.5:
                     a = 3
 
-                new_neutrons = []
-                speed_new_neutron_direction = np.cross(particle.speed, possible_neighbour.speed)  # won't interfere with either of other particles
+                speed_new_neutron_direction = np.cross(speed_i, speed_j)  # won't interfere with either of other particles
                 speed_new_neutron_direction_norm = np.linalg.norm(speed_new_neutron_direction)
                 if speed_new_neutron_direction_norm == 0:
                     speed_new_neutron_norm = self.random_unit_vector()
                 else:
                     speed_new_neutron_norm = speed_new_neutron_direction / speed_new_neutron_direction_norm
 
-                for i in range(a):
-                    speed_new_neutron = neutron_speed_magnitude * (speed_new_neutron_norm + self.random_unit_vector() * 0.4 )/ 1.4 # to add some noise
-
-                    position_new_neutron = particle.position + speed_new_neutron * simulation_speed # to not interact directly again.
-                    new_neutron = Particle(type ="neutron",position = position_new_neutron, speed = speed_new_neutron, mass = self.mass_neutron, radius= self.radius_neutron)
-                    new_neutrons.append(new_neutron)
+                speeds_new_neutrons = []
+                for _ in range(a):
+                    speeds_new_neutrons.append(neutron_speed_magnitude * (speed_new_neutron_norm + self.random_unit_vector() * 0.4 )/ 1.4) # to add some noise
+                speeds_new_neutrons = np.array(speeds_new_neutrons)
+                positions_new_neutrons = particles.positions[i] + speeds_new_neutrons * simulation_speed # to not interact directly again.
                                         # >>>
 
-                old_uranium = (particle if particle.type == "uranium_235" else possible_neighbour)
-                old_uranium.cooldown = -1
-
+                old_uranium = i if types[i] == URANIUM_235 else j
+                particles.cooldown[old_uranium] = DELETED
+                uranium_position = particles.positions[old_uranium]
 
                 product_dir = speed_new_neutron_norm + self.random_unit_vector() * 0.4
                 speed_new_barium = -speed_magnitude_new_products * product_dir / 1.4 # opposite directions + randomness
                 speed_new_krypton = speed_magnitude_new_products * product_dir / 1.4
 
-                new_barium = Particle(type ="barium",position = old_uranium.position + simulation_speed * speed_new_barium, speed = speed_new_barium, mass = self.mass_barium, radius= self.radius_barium)
-                new_krypton = Particle(type ="krypton",position = old_uranium.position + simulation_speed * speed_new_krypton, speed = speed_new_krypton, mass = self.mass_krypton, radius= self.radius_krypton)
-
-                spawned = [new_neutrons , [new_barium], [new_krypton]]
-                deleted = old_uranium
-                return spawned, deleted
+                neutron_ids, barium_id, krypton_id = particles.allocate_ids(a), particles.allocate_ids(1), particles.allocate_ids(1)
+                spawned = [
+                    (NEUTRON, positions_new_neutrons, speeds_new_neutrons, self.mass_neutron, self.radius_neutron, neutron_ids),
+                    (BARIUM, uranium_position + simulation_speed * speed_new_barium, speed_new_barium, self.mass_barium, self.radius_barium, barium_id),
+                    (KRYPTON, uranium_position + simulation_speed * speed_new_krypton, speed_new_krypton, self.mass_krypton, self.radius_krypton, krypton_id),
+                ]
+                if self.fission_log is not None:
+                    neutron = j if old_uranium == i else i
+                    self._log_fissions(particles, np.array([neutron]), np.array([old_uranium]),
+                                       np.linalg.norm((speed_i - speed_j)[None], axis=1),
+                                       np.pad(neutron_ids, (0, 3 - a), constant_values=-1)[None], barium_id, krypton_id)
+                return spawned, old_uranium
 
             else:
                 # normal interaction
-                particle.collision_interact(possible_neighbour)
+                self._collide(particles, i, j)
                 return None, None
         else:
             # normal interaction
-            particle.collision_interact(possible_neighbour)
+            self._collide(particles, i, j)
             return None, None
 
-    def one_simulation_step(self, particles, metadata):
+    def _resolve_contacts_sequential(self, particles, contacts):
+        """reference path: resolves the contacts one pair at a time in nested-loop order"""
         new_particles = []
         old_particles = []
-
-        for particle in particles:
-            particle.forward() # move in space
-            for i in range(3):
-                if particle.position[i] > bounding_parameter: # reflect and clamp
-                    particle.position[i] = bounding_parameter
-                    particle.speed[i] *= -1
-                elif particle.position[i] < -bounding_parameter:
-                    particle.position[i] = -bounding_parameter
-                    particle.speed[i] *= -1
-
-        # Check each pair once to avoid duplicate/self collision work.-> more efficient and clean <<<
-        particle_count = len(particles)
-        for i in range(particle_count): # separated from previous loop. bc scaling AND precision.
-
-            particle = particles[i]
-            if particle.cooldown == -1: # skip marked (split/removed) particles
+        interactions = 0
+
+        cooldown = particles.cooldown
+        draws = self.rng.random((len(contacts), 2)) # the Bernoulli trials of the whole step in one call
+        for k, (i, j) in enumerate(contacts.tolist()):
+            if self._can_interact(cooldown, i, j): # cooldowns change while resolving -> checked one by one
+                interactions += 1
+                spawned, deleted = self._execute_collision_or_interaction(particles, i, j, draws[k])
+
+                if spawned is not None:
+                    new_particles.extend(spawned)
+
+                if deleted is not None: # delete the uranium which got split
+                    old_particles.append(deleted)
+
+        if self.telemetry is not None:
+            self.telemetry.count("fissions", len(old_particles))
+            self.telemetry.count("bounces", interactions - len(old_particles))
+        return new_particles, old_particles
+
+    def _resolve_contacts(self, particles, contacts):
+        """Resolves the contacts of a step with the outcome of the sequential loop, in rounds.
+
+        Every round takes the pending contacts that come first for both of their particles
+        (collisions.first_contacts), so each particle meets its contacts in nested-loop order with
+        the cooldowns and velocities the earlier ones left, and can bounce or split several times
+        per step like in the reference path. A round is disjoint, its bounces are applied in bulk;
+        the fission tests of the whole step take one draw (draws[k] for contact k). numba walks the
+        contacts in order instead, which gives the same result. Returns the spawn groups and the
+        indices of the split uranium, like the reference path.
+        """
+        draws = self.rng.random(len(contacts))
+        if self.backend == "numba":
+            fission_prob = -1.0 if self.fission_prob_hardcoded_parameter is None else self.fission_prob_hardcoded_parameter
+            empty = np.empty(1)
+            table = (empty, 0.0, 0.0, empty) if self.cross_section is None else self.cross_section.kernel_arrays()
+            fissions, speeds, bounces = kernels.resolve_contacts(
+                contacts, draws, particles.type_codes, particles.mass, particles.velocities, particles.cooldown,
+                interaction_cooldown_parameter, fission_prob, *table, NEUTRON, URANIUM_235, DELETED)
+            speed_i, speed_j = speeds[:, 0], speeds[:, 1]
+        else:
+            fissions, speed_i, speed_j, bounces = self._resolve_rounds(particles, contacts, draws)
+
+        if self.telemetry is not None:
+            self.telemetry.count("fissions", len(fissions))
+            self.telemetry.count("bounces", bounces)
+        if not len(fissions):
+            return [], []
+        return self._fission_products(particles, contacts[fissions, 0], contacts[fissions, 1], speed_i, speed_j)
+
+    def _resolve_rounds(self, particles, contacts, draws):
+        """numpy part of _resolve_contacts: bounces applied, returns the splitting contacts (in order),
+        the velocities of their particles at that moment and the number of bounces"""
+        types, velocities, cooldown, mass = particles.type_codes, particles.velocities, particles.cooldown, particles.mass
+        pending = np.arange(len(contacts))
+        fissions, speeds_i, speeds_j = [], [], []
+        bounces = 0
+        while len(pending):
+            first = first_contacts(contacts[pending], len(cooldown))
+            ready, pending = pending[first], pending[~first]
+            i, j = contacts[ready, 0], contacts[ready, 1]
+            active = can_interact(cooldown, i, j) # cooldowns change from round to round
+            ready, i, j = ready[active], i[active], j[active]
+            if not len(ready):
                 continue
 
-            for j in range(i + 1, particle_count):
-
-                possible_neighbour = particles[j]
-
-                if possible_neighbour.cooldown == -1:  # same principle as above: skip marked (split/removed) particles
-                    continue
-
-                if self._check_for_collision(particle, possible_neighbour):
-                    spawned, deleted = self._execute_collision_or_interaction(particle, possible_neighbour)
-
-                    if spawned is not None:
-                        for spawned_group in spawned:
-                            new_particles.extend(spawned_group)
+            fission_pair = ((types[i] == NEUTRON) & (types[j] == URANIUM_235)) | ((types[i] == URANIUM_235) & (types[j] == NEUTRON))
+            fission = np.zeros(len(ready), dtype=bool)
+            if fission_pair.any():
+                if self.fission_prob_hardcoded_parameter is not None:
+                    fission_prob = self.fission_prob_hardcoded_parameter # for the simulation to work with fewer particles.
+                else:
+                    fission_prob, _ = self._fission_probabilities(velocities[i[fission_pair]], velocities[j[fission_pair]])
+                fission[fission_pair] = draws[ready[fission_pair]] < fission_prob
+            if fission.any():
+                split_i, split_j = i[fission], j[fission]
+                fissions.append(ready[fission])
+                speeds_i.append(velocities[split_i])
+                speeds_j.append(velocities[split_j])
+                cooldown[np.where(types[split_i] == URANIUM_235, split_i, split_j)] = DELETED # out for the later rounds
+
+            # normal interaction for everything that did not split
+            bounce_i, bounce_j = i[~fission], j[~fission]
+            bounces += len(bounce_i)
+            velocities[bounce_i], velocities[bounce_j] = elastic_collision(
+                mass[bounce_i, None], mass[bounce_j, None], velocities[bounce_i], velocities[bounce_j])
+            cooldown[bounce_i] = interaction_cooldown_parameter # to avoid endless interactions
+            cooldown[bounce_j] = interaction_cooldown_parameter
+
+        if not fissions:
+            return np.empty(0, dtype=np.intp), None, None, bounces
+        fissions = np.concatenate(fissions)
+        order = np.argsort(fissions, kind="stable") # products in contact order, like the other paths
+        return fissions[order], np.concatenate(speeds_i)[order], np.concatenate(speeds_j)[order], bounces
+
+    def _fission_products(self, particles, i, j, speed_i, speed_j):
+        """2-3 neutrons plus barium and krypton for every split pair, all drawn in one go.
+        speed_i, speed_j: velocities of the pairs when they met (later bounces of the step may have changed them)"""
+        count = len(i)
+        types = particles.type_codes
+        old_uranium = np.where(types[i] == URANIUM_235, i, j)
+        particles.cooldown[old_uranium] = DELETED
+
+        neutrons_per_fission = np.where(self.rng.random(count) < 0.5, 3, 2)
+        noise = self.random_unit_vectors(5 * count).reshape(count, 5, 3) # fallback direction, 3 neutrons, products
+
+        direction = np.cross(speed_i, speed_j) # won't interfere with either of other particles
+        direction_norm = np.linalg.norm(direction, axis=1, keepdims=True)
+        direction = np.where(direction_norm == 0, noise[:, 0], direction / np.where(direction_norm == 0, 1, direction_norm))
+
+        neutron_slots = np.arange(3) < neutrons_per_fission[:, None] # which of the 3 noise vectors are used
+        speeds_new_neutrons = (neutron_speed_magnitude * (direction[:, None] + noise[:, 1:4] * 0.4) / 1.4)[neutron_slots] # to add some noise
+        positions_new_neutrons = np.repeat(particles.positions[i], neutrons_per_fission, axis=0) + speeds_new_neutrons * simulation_speed # to not interact directly again.
+
+        uranium_positions = particles.positions[old_uranium]
+        product_dir = direction + noise[:, 4] * 0.4
+        speed_new_barium = -speed_magnitude_new_products * product_dir / 1.4 # opposite directions + randomness
+        speed_new_krypton = speed_magnitude_new_products * product_dir / 1.4
+
+        neutron_ids = particles.allocate_ids(len(speeds_new_neutrons))
+        barium_ids, krypton_ids = particles.allocate_ids(count), particles.allocate_ids(count)
+        spawned = [
+            (NEUTRON, positions_new_neutrons, speeds_new_neutrons, self.mass_neutron, self.radius_neutron, neutron_ids),
+            (BARIUM, uranium_positions + simulation_speed * speed_new_barium, speed_new_barium, self.mass_barium, self.radius_barium, barium_ids),
+            (KRYPTON, uranium_positions + simulation_speed * speed_new_krypton, speed_new_krypton, self.mass_krypton, self.radius_krypton, krypton_ids),
+        ]
+        if self.fission_log is not None:
+            child_neutrons = np.full((count, 3), -1, dtype=np.int64)
+            child_neutrons[neutron_slots] = neutron_ids
+            self._log_fissions(particles, np.where(old_uranium == i, j, i), old_uranium, np.linalg.norm(speed_i - speed_j, axis=1),
+                               child_neutrons, barium_ids, krypton_ids)
+        return spawned, old_uranium
+
+    def _log_fissions(self, particles, neutrons, uranium, v_dif, child_neutrons, barium_ids, krypton_ids):
+        self.fission_log.record(
+            self._step,
+            neutron_id=particles.ids[neutrons],
+            uranium_id=particles.ids[uranium],
+            position=particles.positions[uranium],
+            v_dif=v_dif,
+            child_neutrons=child_neutrons,
+            barium_id=barium_ids,
+            krypton_id=krypton_ids,
+        )
+
+    def _move(self, particles):
+        telemetry = self.telemetry
+        if self.backend == "numba":
+            kernels.move_and_reflect(particles.positions, particles.velocities, particles.cooldown, simulation_speed, self.bounding_parameter)
+            if telemetry is not None:
+                telemetry.lap("move") # one kernel, reflection included
+        else:
+            particles.forward() # move in space
+            if telemetry is not None:
+                telemetry.lap("move")
+            particles.reflect(self.bounding_parameter) # reflect and clamp
+            if telemetry is not None:
+                telemetry.lap("reflect")
+
+    def _find_contacts(self, particles):
+        """contact pairs in the same order as the nested i/j loop"""
+        if self.adaptive:
+            return self._find_contacts_adaptive(particles)
+        if self.backend == "python":
+            if self.telemetry is not None:
+                self.telemetry.count("candidate_pairs", len(particles) * (len(particles) - 1) // 2)
+            return brute_force_pairs(particles.positions, particles.radius, radius_multiplicator)
+        if self.workers:
+            self.start_workers()
+            if self.telemetry is not None:
+                self.telemetry.count("candidate_pairs", -1)
+            return self._domains.find_contacts(particles.positions, particles.radius)
+        if self.backend == "numba":
+            if self.telemetry is not None:
+                self.telemetry.count("candidate_pairs", -1)
+            return kernels.find_contacts(particles.positions, particles.radius, self.bounding_parameter, radius_multiplicator)
+        if self.telemetry is not None: # same as find_contacts, split to count the candidates
+            if len(particles) < 2:
+                return find_contacts(particles.positions, particles.radius, self.bounding_parameter, radius_multiplicator)
+            radius = particles.radius
+            candidates = cell_list_pairs(particles.positions, 2 * radius.max() * radius_multiplicator, self.bounding_parameter)
+            self.telemetry.count("candidate_pairs", len(candidates))
+            return contact_pairs(particles.positions, radius, candidates, radius_multiplicator)
+        return find_contacts(particles.positions, particles.radius, self.bounding_parameter, radius_multiplicator)
+
+    def _find_contacts_adaptive(self, particles):
+        """Event-driven variant of the search: a full search also yields the earliest time a pair that
+        is not in contact yet can touch. Until then only the pairs already in contact are re-checked.
+
+        Besides spawning, only bounces change speeds, and contacts_and_horizon already accounts for
+        the pairs in contact bouncing off each other, so the prediction holds until a fission can
+        happen. The step grid (dt, cooldowns, one frame and one count per step) stays the same, so
+        results are identical to the plain search.
+        """
+        if self._quiet_steps > 0:
+            self._quiet_steps -= 1
+            self.skipped_searches += 1
+            contacts = contact_pairs(particles.positions, particles.radius, self._touching, radius_multiplicator)
+            if self.telemetry is not None:
+                self.telemetry.count("candidate_pairs", len(self._touching))
+        else:
+            if self.telemetry is not None:
+                self.telemetry.count("candidate_pairs", -1)
+            search = kernels.contacts_and_horizon if self.backend == "numba" else contacts_and_horizon
+            contacts, horizon = search(particles.positions, particles.velocities, particles.radius, particles.mass,
+                                       self.bounding_parameter, radius_multiplicator, self.skin)
+            self._touching = contacts
+            # steps k = 1, 2, ... from now are quiet while k * dt < horizon (small margin for rounding)
+            quiet = min(horizon * (1 - 1e-9) / simulation_speed, self.simulation_steps)
+            self._quiet_steps = max(int(np.ceil(quiet)) - 1, 0)
+
+        i, j = contacts[:, 0], contacts[:, 1]
+        types, cooldown = particles.type_codes, particles.cooldown
+        fission_pair = ((types[i] == NEUTRON) & (types[j] == URANIUM_235)) | ((types[i] == URANIUM_235) & (types[j] == NEUTRON))
+        if (fission_pair & ((cooldown[i] == 0) | (cooldown[i] != cooldown[j]))).any(): # may spawn -> predict again
+            self._quiet_steps = 0
+        return contacts
+
+    def new_metadata(self, particles):
+        """count series for a run starting from `particles`"""
+        return CountSeries(min(self.simulation_steps, PREALLOCATED_STEPS), particles.type_counts)
 
-                    if deleted is not None: # delete the uranium which got split
-                        old_particles.append(deleted)
+    def one_simulation_step(self, particles, metadata):
+        """metadata: CountSeries from `new_metadata`, gets this step's counts appended"""
+        self._step = metadata.length # index of this step in the count series
+        telemetry = self.telemetry
+        if telemetry is not None:
+            telemetry.begin_step(len(particles))
+        self._move(particles)
+
+        contacts = self._find_contacts(particles)
+        if telemetry is not None:
+            telemetry.count("contacts", len(contacts))
+            telemetry.lap("search")
+        if self.backend == "python":
+            new_particles, old_particles = self._resolve_contacts_sequential(particles, contacts)
+        else:
+            new_particles, old_particles = self._resolve_contacts(particles, contacts)
+        if telemetry is not None:
+            telemetry.lap("resolve")
 
-        # >>>
         # kind of what the method returns
-        if new_particles:
-            particles.extend(new_particles)
+        if len(old_particles):
+            particles.remove(old_particles, keep_order=self.backend == "python") # the reference keeps the original row order
 
-        if old_particles:
-            for old_particle in old_particles:
-                particles.remove(old_particle)
+        particles.reserve(sum(len(group[1]) for group in new_particles)) # one allocation for all products
+        for spawned_group in new_particles:
+            particles.add(*spawned_group)
+        if telemetry is not None:
+            telemetry.lap("spawn_remove")
 
-        # metadata counts (recompute by type to avoid mixing products)
-        counts = {"neutron": 0, "uranium_235": 0, "barium": 0, "krypton": 0}
-        for particle in particles:
-            if particle.cooldown == -1:
-                continue
-            counts[particle.type] += 1
-
-        metadata["neutron_counts"].append(counts["neutron"])
-        metadata["uranium_counts"].append(counts["uranium_235"])
-        metadata["barium_counts"].append(counts["barium"])
-        metadata["krypton_counts"].append(counts["krypton"])
+        metadata.append(particles.type_counts) # kept up to date by the store, no rescan
+        if telemetry is not None:
+            telemetry.lap("count")
 
         return particles, metadata
 
-    def _snapshot_particles(self, particles):
-        snapshot_positions = {"neutron": [], "uranium_235": [], "barium": [], "krypton": []}
-        for particle in particles:
-            snapshot_positions[particle.type].append(particle.position.copy()) # copy () fixes mutable bug
-        return snapshot_positions
-
-
-    def simulate(self, uranium_threshold = 0.0):
-        particles = self._innitialize_particles()
-        metadata = {
-            "uranium_counts": [self.uranium_start],
-            "neutron_counts": [self.neutrons_start],
-            "barium_counts": [0],
-            "krypton_counts": [0],
-        }
-        all_snapshots_positions = []
-
-        for i in range(self.simulation_steps):
-            self.one_simulation_step(particles, metadata)  # modifies particles and metadata directly
-            all_snapshots_positions.append(self._snapshot_particles(particles)) # save snapshot of positions
-
-            # check if uranium bellow treshold
-            if metadata["uranium_counts"][-1] <= uranium_threshold * metadata["uranium_counts"][0]:
-                return all_snapshots_positions, metadata
-
-        return all_snapshots_positions, metadata
+    def simulate(self, uranium_threshold = 0.0, sink=None, checkpoint_path=None, checkpoint_every=None, resume_from=None):
+        """Runs until simulation_steps or the uranium threshold. Every frame is handed to `sink.write(particles)`,
+        e.g. a SnapshotWriter that streams to disk; by default the frames are collected in memory.
+
+        checkpoint_path: write a checkpoint (core.checkpoint) there every `checkpoint_every` steps and at the end.
+        resume_from: continue the run of that checkpoint instead of starting a new one; simulation_steps counts
+        the steps of the whole run, so a larger value extends a finished run. The result is bit-for-bit the
+        one of an uninterrupted run. The sink only gets the frames from the resumed step on, the threshold
+        stays relative to the uranium count at step 0 and a fission log on disk is cut back to the checkpoint."""
+        if resume_from is None:
+            particles = self._innitialize_particles()
+            metadata = self.new_metadata(particles)
+            self._quiet_steps = 0
+        else:
+            particles, metadata = self._resume(resume_from)
+        snapshots = SnapshotList() if sink is None else sink
+
+        try:
+            for i in range(metadata.length - 1, self.simulation_steps):
+                self.one_simulation_step(particles, metadata)  # modifies particles and metadata directly
+                snapshots.write(particles) # save snapshot of positions
+                if self.telemetry is not None:
+                    self.telemetry.lap("snapshot")
+
+                # check if uranium bellow treshold
+                if metadata["uranium_counts"][-1] <= uranium_threshold * metadata["uranium_counts"][0]:
+                    break
+                if checkpoint_every and checkpoint_path is not None and (metadata.length - 1) % checkpoint_every == 0:
+                    write_checkpoint(checkpoint_path, self, particles, metadata)
+        finally:
+            self.close()
+
+        if checkpoint_path is not None:
+            write_checkpoint(checkpoint_path, self, particles, metadata)
+        return snapshots, metadata
+
+    def start_workers(self):
+        """starts the search workers now instead of on the first step (no-op without workers or if running)"""
+        if self.workers and self._domains is None:
+            self._domains = DomainSearch(self.workers, self.bounding_parameter, radius_multiplicator, self.backend)
+
+    def close(self):
+        """stops the search workers, if any (they are started again when needed)"""
+        if self._domains is not None:
+            self._domains.close()
+            self._domains = None
+
+    def _resume(self, path):
+        """particles and count series of a checkpoint, with the random generator and adaptive state restored"""
+        checkpoint = read_checkpoint(path)
+        fission_prob = self.fission_prob_hardcoded_parameter
+        saved_prob = float(checkpoint["fission_prob"])
+        if (str(checkpoint["backend"]) != self.backend or float(checkpoint["bounding_parameter"]) != self.bounding_parameter
+                or (np.isnan(saved_prob) != (fission_prob is None)) or (fission_prob is not None and saved_prob != fission_prob)):
+            raise ValueError(f"checkpoint {path} was written by a simulation with another backend, box or fission probability")
+
+        particles = checkpoint_particles(checkpoint, capacity=2 * (self.neutrons_start + self.uranium_start))
+        metadata = CountSeries.from_counts(checkpoint["counts"], min(self.simulation_steps, PREALLOCATED_STEPS))
+        self._quiet_steps = int(checkpoint["quiet_steps"])
+        self._touching = checkpoint["touching"]
+        if self.fission_log is not None and int(checkpoint["fission_events"]) >= 0:
+            self.fission_log.truncate(int(checkpoint["fission_events"]))
+        restore_random_state(checkpoint, self.rng)
+        return particles, metadata
 
 if __name__ == "__main__":
     simulation = Simulation(simulation_steps=simulation_steps, uranium_start=uranium_start, neutrons_start=neutrons_start)
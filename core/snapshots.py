@@ -0,0 +1,597 @@
+"""On-disk snapshot store that is written while the simulation runs and read lazily.
+
+Layout of a snapshot directory:
+    manifest.json          types, encoding, chunk size, compression, delta settings and the number of complete frames
+    <type>_pos.bin         stored position rows of all frames, appended frame after frame (raw rows or compressed chunks)
+    <type>_offsets.bin     int64 row offsets, frame f is rows offsets[f]:offsets[f + 1]
+    <type>_chunks.bin      only with compression: int64 (byte start, byte end) of every chunk in <type>_pos.bin
+    <type>_ids.bin         int64 particle id of every stored row (rows of a frame are sorted by id)
+    <type>_gone.bin        only in delta mode: ids that disappeared in a frame, indexed by <type>_gone_offsets.bin
+    births.bin / deaths.bin
+                           (id, type code, frame) of every particle that appeared / disappeared, this is the
+                           index behind SnapshotReader.trajectory, particles_in_frame, births and deaths
+
+Frames are buffered in memory and appended in chunks of `chunk_frames`, the manifest is
+replaced atomically after every chunk, so a killed run keeps every chunk written so far.
+Uncompressed stores are memory-mapped by SnapshotReader; compressed ones decompress one chunk per seek.
+
+Size options of SnapshotWriter (all reconstructed transparently by SnapshotReader):
+    every=k               keep only every k-th frame
+    dtype                 float32, float16 or int16 (coordinates quantized over [-bound, bound] widened by
+                          SPAWN_MARGIN, how far outside the box fission products can be placed)
+    tolerance / keyframe_interval
+                          delta mode: every keyframe_interval-th frame stores all particles, the frames in
+                          between only the particles that moved more than `tolerance` since they were last
+                          stored (plus new and vanished ids)
+
+    python -m core.snapshots convert cached_runs/<run>/snapshots.npz [--compression zlib]
+"""
+import argparse
+import json
+import os
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+from core.parameters import neutron_speed_magnitude, simulation_speed, speed_magnitude_new_products
+from core.particles import TYPES
+
+FORMAT_VERSION = 4
+ID_DTYPE = np.dtype(np.int64) # ParticleStore ids, never narrowed
+EVENT_DTYPE = np.dtype([("id", np.int64), ("type", np.int8), ("frame", np.int64)])
+COMPRESSIONS = (None, "zlib")
+DTYPES = (np.float32, np.float16, np.int16)
+DEFAULT_KEYFRAME_INTERVAL = 100
+QUANTIZATION_LEVELS = 32767
+SPAWN_MARGIN = max(neutron_speed_magnitude, speed_magnitude_new_products) * simulation_speed # products start one step away
+
+
+def snapshot_positions(particles):
+    """positions of one frame grouped by type name"""
+    positions = particles.positions
+    type_codes = particles.type_codes
+    return {t: positions[type_codes == code].copy() for code, t in enumerate(TYPES)} # copy () fixes mutable bug
+
+
+class SnapshotList(list):
+    """in-memory sink, the default of Simulation.simulate (one dict per frame)"""
+
+    def write(self, particles):
+        self.append(snapshot_positions(particles))
+
+    def close(self):
+        pass
+
+
+class DiscardFrames:
+    """sink that drops every frame, for runs where only the counts matter"""
+
+    def write(self, particles):
+        pass
+
+    def close(self):
+        pass
+
+
+def _write_json_atomic(path, payload):
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump(payload, f)
+    os.replace(tmp, path)
+
+
+def read_manifest(directory):
+    with (Path(directory) / "manifest.json").open("r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    # defaults for stores written by older versions
+    manifest.setdefault("compression", None)
+    manifest.setdefault("every", 1)
+    manifest.setdefault("keyframe_interval", None)
+    manifest.setdefault("tolerance", 0.0)
+    manifest.setdefault("scale", None)
+    manifest.setdefault("ids", manifest["keyframe_interval"] is not None)
+    manifest.setdefault("id_dtype", "<i8")
+    return manifest
+
+
+class SnapshotWriter:
+    """Streaming sink for Simulation.simulate, memory stays bounded by one chunk of frames.
+
+    compression=None keeps raw rows (memory-mappable), "zlib" compresses every chunk of a type.
+    See the module docstring for every / dtype / tolerance / keyframe_interval.
+    ids=False is only meant for sources without particle identities (old npz archives).
+    """
+
+    def __init__(self, directory, chunk_frames=256, dtype=np.float32, compression=None,
+                 every=1, keyframe_interval=None, tolerance=0.0, bound=None, ids=True):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"unknown compression {compression!r}, expected one of {COMPRESSIONS}")
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in [np.dtype(d) for d in DTYPES]:
+            raise ValueError(f"unsupported snapshot dtype {self.dtype}")
+        if self.dtype == np.int16 and bound is None:
+            raise ValueError("quantized (int16) snapshots need the box bound")
+
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.chunk_frames = chunk_frames
+        self.compression = compression
+        self.every = every
+        self.tolerance = tolerance
+        self.delta = keyframe_interval is not None or tolerance > 0
+        if self.delta and not ids:
+            raise ValueError("delta snapshots need particle ids")
+        self.ids = ids
+        self.keyframe_interval = (keyframe_interval or DEFAULT_KEYFRAME_INTERVAL) if self.delta else None
+        self.scale = (bound + SPAWN_MARGIN) / QUANTIZATION_LEVELS if self.dtype == np.int16 else None
+        self.frames = 0
+
+        self._calls = 0
+        self._pending = {t: {"rows": [], "ids": [], "gone": []} for t in TYPES} # blocks of the buffered frames
+        self._pending_frames = 0
+        self._rows = {t: 0 for t in TYPES}
+        self._gone_rows = {t: 0 for t in TYPES}
+        self._bytes = {t: 0 for t in TYPES}
+        self._reference = {} # delta mode: type -> (ids, last stored positions)
+        self._live = {t: np.empty(0, dtype=np.int64) for t in TYPES} # sorted ids of the last frame
+        self._pending_events = {"births": [], "deaths": []}
+
+        self._files = {}
+        for t in TYPES:
+            self._open(f"{t}_pos")
+            self._open(f"{t}_offsets", np.zeros(1, dtype=np.int64))
+            if compression:
+                self._open(f"{t}_chunks")
+            if ids:
+                self._open(f"{t}_ids")
+            if self.delta:
+                self._open(f"{t}_gone")
+                self._open(f"{t}_gone_offsets", np.zeros(1, dtype=np.int64))
+        if ids:
+            self._open("births")
+            self._open("deaths")
+        self._write_manifest()
+
+    def _open(self, name, header=None):
+        self._files[name] = (self.directory / f"{name}.bin").open("wb")
+        if header is not None:
+            header.tofile(self._files[name])
+
+    def _write_manifest(self):
+        _write_json_atomic(self.directory / "manifest.json", {
+            "version": FORMAT_VERSION,
+            "types": list(TYPES),
+            "dtype": self.dtype.str,
+            "scale": self.scale,
+            "chunk_frames": self.chunk_frames,
+            "compression": self.compression,
+            "every": self.every,
+            "keyframe_interval": self.keyframe_interval,
+            "tolerance": self.tolerance,
+            "ids": self.ids,
+            "id_dtype": ID_DTYPE.str,
+            "frames": self.frames,
+        })
+
+    def _encode(self, positions):
+        if self.scale is not None:
+            return np.clip(np.round(positions / self.scale), -QUANTIZATION_LEVELS, QUANTIZATION_LEVELS).astype(np.int16)
+        return positions.astype(self.dtype)
+
+    def _decode(self, rows):
+        if self.scale is not None:
+            return rows.astype(np.float32) * np.float32(self.scale)
+        return rows.astype(np.float32, copy=False)
+
+    def write(self, particles):
+        """buffer one frame (every `every`-th call), a full chunk goes to disk"""
+        self._calls += 1
+        if (self._calls - 1) % self.every:
+            return
+        type_codes = particles.type_codes
+        ids = particles.ids
+        order = np.lexsort((ids, type_codes)) # grouped by type, ascending ids inside a type
+        bounds = np.concatenate(([0], np.cumsum(np.bincount(type_codes, minlength=len(TYPES)))))
+        positions, ids = particles.positions[order], ids[order]
+        self._buffer_frame(
+            {t: positions[bounds[code]:bounds[code + 1]] for code, t in enumerate(TYPES)},
+            {t: ids[bounds[code]:bounds[code + 1]] for code, t in enumerate(TYPES)},
+        )
+
+    def write_frame(self, frame, ids=None):
+        """buffer one frame given as {type: (rows, 3) positions} and, unless ids=False, {type: sorted ids}"""
+        if self.ids and ids is None:
+            raise ValueError("this snapshot store records particle ids")
+        self._calls += 1
+        if (self._calls - 1) % self.every:
+            return
+        self._buffer_frame(frame, ids)
+
+    def _events(self, ids, type_code, frame):
+        events = np.empty(len(ids), dtype=EVENT_DTYPE)
+        events["id"], events["type"], events["frame"] = ids, type_code, frame
+        return events
+
+    def _buffer_frame(self, frame, ids):
+        index = self.frames_buffered
+        keyframe = self.delta and index % self.keyframe_interval == 0
+        for code, t in enumerate(TYPES):
+            rows = self._encode(np.asarray(frame.get(t, ()), dtype=np.float64).reshape(-1, 3))
+            pending = self._pending[t]
+            if not self.ids:
+                pending["rows"].append(rows)
+                continue
+
+            type_ids = np.asarray(ids.get(t, ()), dtype=np.int64)
+            live = self._live[t]
+            born = np.setdiff1d(type_ids, live, assume_unique=True)
+            gone = np.setdiff1d(live, type_ids, assume_unique=True)
+            self._live[t] = type_ids
+            self._pending_events["births"].append(self._events(born, code, index))
+            self._pending_events["deaths"].append(self._events(gone, code, index))
+
+            if not self.delta:
+                pending["rows"].append(rows)
+                pending["ids"].append(type_ids)
+                continue
+
+            stored = self._decode(rows)
+            if keyframe or t not in self._reference:
+                changed = np.ones(len(type_ids), dtype=bool)
+                reference = stored
+            else:
+                reference_ids, reference_positions = self._reference[t]
+                where = np.minimum(np.searchsorted(reference_ids, type_ids), max(len(reference_ids) - 1, 0))
+                known = (reference_ids[where] == type_ids) if len(reference_ids) else np.zeros(len(type_ids), dtype=bool)
+                changed = ~known
+                moved = np.linalg.norm(stored[known] - reference_positions[where[known]], axis=1) > self.tolerance
+                changed[known] = moved
+                # unchanged particles keep the value the reader will reconstruct for them
+                reference = np.where(changed[:, None], stored, reference_positions[where] if len(reference_ids) else stored)
+
+            self._reference[t] = (type_ids, reference)
+            pending["rows"].append(rows[changed])
+            pending["ids"].append(type_ids[changed])
+            pending["gone"].append(gone if not keyframe else gone[:0])
+
+        self._pending_frames += 1
+        if self._pending_frames >= self.chunk_frames:
+            self._flush_chunk()
+
+    @property
+    def frames_buffered(self):
+        return self.frames + self._pending_frames
+
+    def _append_indexed(self, name, blocks, start):
+        """append blocks to <name>.bin and their end offsets to <name>_offsets.bin, returns the new row count"""
+        ends = start + np.cumsum([len(block) for block in blocks], dtype=np.int64)
+        data = np.concatenate(blocks)
+        if len(data):
+            data.tofile(self._files[name])
+        ends.tofile(self._files[f"{name}_offsets"])
+        return int(ends[-1])
+
+    def _flush_chunk(self):
+        # chunks are always full except the last one, so frame f lives in chunk f // chunk_frames
+        if not self._pending_frames:
+            return
+        for t in TYPES:
+            pending = self._pending[t]
+            blocks = pending["rows"]
+            ends = self._rows[t] + np.cumsum([len(block) for block in blocks], dtype=np.int64)
+            data = np.concatenate(blocks)
+            if self.compression:
+                payload = zlib.compress(data.tobytes(), 1)
+                self._files[f"{t}_pos"].write(payload)
+                np.array([self._bytes[t], self._bytes[t] + len(payload)], dtype=np.int64).tofile(self._files[f"{t}_chunks"])
+                self._bytes[t] += len(payload)
+            elif len(data):
+                data.tofile(self._files[f"{t}_pos"])
+            ends.tofile(self._files[f"{t}_offsets"])
+            self._rows[t] = int(ends[-1])
+
+            if self.ids:
+                np.concatenate(pending["ids"]).astype(ID_DTYPE).tofile(self._files[f"{t}_ids"])
+            if self.delta:
+                self._gone_rows[t] = self._append_indexed(f"{t}_gone", pending["gone"], self._gone_rows[t])
+            for column in pending.values():
+                column.clear()
+        for name, events in self._pending_events.items():
+            if events:
+                np.concatenate(events).tofile(self._files[name])
+                events.clear()
+        for f in self._files.values():
+            f.flush()
+
+        self.frames += self._pending_frames
+        self._pending_frames = 0
+        self._write_manifest() # only now the new frames count as written
+
+    def close(self):
+        self._flush_chunk()
+        for f in self._files.values():
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SnapshotReader:
+    """Lazy random access to the frames of a snapshot directory.
+
+    Nothing is read up front: offsets and raw positions are memory-mapped, so seeking to any
+    frame only touches the pages of that frame. Compressed stores decompress one chunk per
+    type and keep the last one, so playing frames in order decompresses every chunk once.
+    Delta stores rebuild a frame from its keyframe and keep the last rebuilt frame, so
+    playing forward applies every delta once.
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.manifest = read_manifest(self.directory)
+        self.types = tuple(self.manifest["types"])
+        self.frames = self.manifest["frames"]
+        self.chunk_frames = self.manifest["chunk_frames"]
+        self.dtype = np.dtype(self.manifest["dtype"])
+        self.scale = self.manifest["scale"]
+        self.compression = self.manifest["compression"]
+        self.every = self.manifest["every"]
+        self.keyframe_interval = self.manifest["keyframe_interval"]
+        self.has_ids = self.manifest["ids"]
+        self.id_dtype = np.dtype(self.manifest["id_dtype"])
+
+        self._offsets = {}
+        self._columns = {}
+        self._chunk_index = {}
+        self._chunk_cache = {} # type -> (chunk number, decompressed rows)
+        self._state_cache = {} # type -> (frame, ids, positions), delta mode only
+        self._lifetimes = None
+
+    def __len__(self):
+        return self.frames
+
+    @property
+    def delta(self):
+        return self.keyframe_interval is not None
+
+    def _memmap(self, name, dtype, shape):
+        if not np.prod(shape):
+            return np.empty(shape, dtype=dtype)
+        return np.memmap(self.directory / name, dtype=dtype, mode="r", shape=shape)
+
+    def _offsets_of(self, name):
+        if name not in self._offsets:
+            self._offsets[name] = self._memmap(f"{name}_offsets.bin", np.int64, (self.frames + 1,))
+        return self._offsets[name]
+
+    def offsets(self, t):
+        return self._offsets_of(t)
+
+    def _column(self, name, dtype, rows, width=None):
+        if name not in self._columns:
+            shape = (rows,) if width is None else (rows, width)
+            self._columns[name] = self._memmap(f"{name}.bin", dtype, shape)
+        return self._columns[name]
+
+    def _chunk_rows(self, t, chunk):
+        cached = self._chunk_cache.get(t)
+        if cached is not None and cached[0] == chunk:
+            return cached[1]
+        if t not in self._chunk_index:
+            chunks = -(-self.frames // self.chunk_frames)
+            self._chunk_index[t] = self._memmap(f"{t}_chunks.bin", np.int64, (chunks, 2))
+        start, end = self._chunk_index[t][chunk]
+        with (self.directory / f"{t}_pos.bin").open("rb") as f:
+            f.seek(int(start))
+            rows = np.frombuffer(zlib.decompress(f.read(int(end - start))), dtype=self.dtype).reshape(-1, 3)
+        self._chunk_cache[t] = (chunk, rows)
+        return rows
+
+    def _decode(self, rows):
+        if self.scale is not None:
+            return rows.astype(np.float32) * np.float32(self.scale)
+        if self.dtype != np.float32:
+            return rows.astype(np.float32)
+        return rows
+
+    def stored_rows(self, t, frame):
+        """positions (as float32) of the rows stored for one type in one frame"""
+        if not 0 <= frame < self.frames:
+            raise IndexError(frame)
+        offsets = self.offsets(t)
+        start, end = int(offsets[frame]), int(offsets[frame + 1])
+        if not self.compression:
+            rows = self._column(f"{t}_pos", self.dtype, int(offsets[-1]), 3)[start:end]
+        else:
+            chunk = frame // self.chunk_frames
+            chunk_start = int(offsets[chunk * self.chunk_frames])
+            rows = self._chunk_rows(t, chunk)[start - chunk_start:end - chunk_start]
+        return self._decode(rows)
+
+    def _rows_at(self, t, rows):
+        """decoded position rows of one type at the ascending global row indices `rows`,
+        compressed stores decompress only the chunks holding them, one at a time"""
+        offsets = self.offsets(t)
+        if not self.compression:
+            return self._decode(self._column(f"{t}_pos", self.dtype, int(offsets[-1]), 3)[rows])
+        chunk_starts = np.asarray(offsets[::self.chunk_frames])
+        chunks = np.searchsorted(chunk_starts, rows, side="right") - 1
+        picked = np.empty((len(rows), 3), dtype=self.dtype)
+        bounds = np.concatenate(([0], np.flatnonzero(np.diff(chunks)) + 1, [len(rows)]))
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            if end > start:
+                chunk = int(chunks[start])
+                picked[start:end] = self._chunk_rows(t, chunk)[rows[start:end] - chunk_starts[chunk]]
+        return self._decode(picked)
+
+    def _find_rows(self, t, particle_id, first, end):
+        """row of `particle_id` in every frame of [first, end), -1 where it is not stored.
+        A binary search per frame (rows of a frame are sorted by id), all frames at once."""
+        ids = self._ids_column(t)
+        offsets = self.offsets(t)
+        frame_end = np.array(offsets[first + 1:end + 1], dtype=np.int64)
+        low, high = np.array(offsets[first:end], dtype=np.int64), frame_end.copy()
+        searching = np.flatnonzero(low < high)
+        while len(searching):
+            middle = (low[searching] + high[searching]) // 2
+            below = ids[middle] < particle_id
+            low[searching[below]] = middle[below] + 1
+            high[searching[~below]] = middle[~below]
+            searching = searching[low[searching] < high[searching]]
+        found = low < frame_end
+        found[found] = ids[low[found]] == particle_id
+        return np.where(found, low, -1)
+
+    def _ids_column(self, t):
+        self._require_ids()
+        return self._column(f"{t}_ids", self.id_dtype, int(self.offsets(t)[-1]))
+
+    def stored_ids(self, t, frame):
+        offsets = self.offsets(t)
+        return self._ids_column(t)[int(offsets[frame]):int(offsets[frame + 1])]
+
+    def _gone_ids(self, t, frame):
+        offsets = self._offsets_of(f"{t}_gone")
+        return self._column(f"{t}_gone", np.int64, int(offsets[-1]))[int(offsets[frame]):int(offsets[frame + 1])]
+
+    def _delta_state(self, t, frame):
+        """(sorted ids, positions) of one type, rebuilt from the last keyframe"""
+        keyframe = frame - frame % self.keyframe_interval
+        cached = self._state_cache.get(t)
+        if cached is not None and keyframe <= cached[0] <= frame:
+            current, ids, positions = cached
+            positions = positions.copy() # frames handed out before must not change
+        else:
+            current = keyframe
+            ids = np.array(self.stored_ids(t, keyframe))
+            positions = np.array(self.stored_rows(t, keyframe))
+
+        for f in range(current + 1, frame + 1):
+            gone = self._gone_ids(t, f)
+            if len(gone):
+                keep = ~np.isin(ids, gone, assume_unique=True)
+                ids, positions = ids[keep], positions[keep]
+            changed_ids = self.stored_ids(t, f)
+            if len(changed_ids):
+                changed = self.stored_rows(t, f)
+                where = np.minimum(np.searchsorted(ids, changed_ids), max(len(ids) - 1, 0))
+                known = (ids[where] == changed_ids) if len(ids) else np.zeros(len(changed_ids), dtype=bool)
+                positions[where[known]] = changed[known]
+                if not known.all():
+                    ids = np.concatenate((ids, changed_ids[~known]))
+                    positions = np.concatenate((positions, changed[~known]))
+                    order = np.argsort(ids, kind="stable")
+                    ids, positions = ids[order], positions[order]
+
+        self._state_cache[t] = (frame, ids, positions)
+        return ids, positions
+
+    def type_positions(self, t, frame):
+        """(rows, 3) positions of one type in one frame"""
+        if not self.delta:
+            return self.stored_rows(t, frame)
+        if not 0 <= frame < self.frames:
+            raise IndexError(frame)
+        return self._delta_state(t, frame)[1]
+
+    def frame(self, frame):
+        """{type: positions} of one frame"""
+        return {t: self.type_positions(t, frame) for t in self.types}
+
+    # identity queries
+
+    def _require_ids(self):
+        if not self.has_ids:
+            raise ValueError(f"{self.directory} has no particle ids (converted from an old archive)")
+
+    def _read_events(self, name):
+        self._require_ids()
+        events = np.fromfile(self.directory / f"{name}.bin", dtype=EVENT_DTYPE)
+        return events[events["frame"] < self.frames] # ignore a chunk that was cut off
+
+    def births(self, frame=None):
+        """(id, type, frame) records of particles appearing, all frames or only `frame`"""
+        events = self._read_events("births")
+        return events if frame is None else events[events["frame"] == frame]
+
+    def deaths(self, frame=None):
+        """(id, type, frame) records of particles gone at `frame` (first frame without them)"""
+        events = self._read_events("deaths")
+        return events if frame is None else events[events["frame"] == frame]
+
+    def lifetime(self, particle_id):
+        """(type name, first frame, end frame exclusive) of one particle"""
+        if self._lifetimes is None:
+            births = np.sort(self.births(), order="id")
+            deaths = self.deaths()
+            end = np.full(len(births), self.frames, dtype=np.int64)
+            end[np.searchsorted(births["id"], deaths["id"])] = deaths["frame"]
+            self._lifetimes = (births, end)
+        births, end = self._lifetimes
+        where = int(np.searchsorted(births["id"], particle_id))
+        if where == len(births) or births["id"][where] != particle_id:
+            raise KeyError(f"particle {particle_id} does not appear in {self.directory}")
+        return self.types[births["type"][where]], int(births["frame"][where]), int(end[where])
+
+    def particles_in_frame(self, frame):
+        """{type: sorted ids} of the particles present in one frame"""
+        if not self.delta:
+            return {t: np.asarray(self.stored_ids(t, frame)) for t in self.types}
+        if not 0 <= frame < self.frames:
+            raise IndexError(frame)
+        return {t: self._delta_state(t, frame)[0] for t in self.types}
+
+    def trajectory(self, particle_id):
+        """(frames, (n, 3) positions) of one particle over its lifetime.
+
+        Its row in every frame of the lifetime is found by a binary search over the ids of that frame,
+        and only those rows are decoded (compressed stores: only the chunks holding them).
+        In delta mode the position is carried forward over frames where it was not stored.
+        """
+        t, first, end = self.lifetime(particle_id)
+        rows = self._find_rows(t, particle_id, first, end)
+        stored = rows >= 0
+        positions = self._rows_at(t, rows[stored])
+
+        stored_frames = np.flatnonzero(stored) + first
+        frames = np.arange(first, end)
+        latest = np.searchsorted(stored_frames, frames, side="right") - 1
+        return frames, positions[latest]
+
+
+def convert_npz(npz_path, directory=None, chunk_frames=256, compression=None):
+    """rewrite an old snapshots.npz archive as a snapshot directory, returns its path"""
+    npz_path = Path(npz_path)
+    directory = Path(directory) if directory is not None else npz_path.with_suffix("")
+    with np.load(npz_path) as npz:
+        types = [t for t in TYPES if f"{t}_offsets" in npz]
+        positions = {t: npz[f"{t}_pos"] for t in types}
+        offsets = {t: npz[f"{t}_offsets"] for t in types}
+    frames = len(offsets[types[0]]) - 1
+
+    with SnapshotWriter(directory, chunk_frames=chunk_frames, dtype=positions[types[0]].dtype, compression=compression, ids=False) as writer:
+        for f in range(frames):
+            writer.write_frame({t: positions[t][offsets[t][f]:offsets[t][f + 1]] for t in types})
+    return directory
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Snapshot store tools.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    convert = commands.add_parser("convert", help="convert an old snapshots.npz into a snapshot directory")
+    convert.add_argument("npz", type=Path)
+    convert.add_argument("--out", type=Path, default=None, help="default: next to the archive, without .npz")
+    convert.add_argument("--chunk-frames", type=int, default=256)
+    convert.add_argument("--compression", choices=[c for c in COMPRESSIONS if c], default=None)
+    args = parser.parse_args(argv)
+
+    directory = convert_npz(args.npz, args.out, args.chunk_frames, args.compression)
+    print(f"Converted {args.npz} to {directory}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""Population-level surrogate of the particle simulation, a stochastic branching process.
+
+Only the counts that simulate writes to metadata.json are modelled. In every step each uranium
+splits with probability 1 - exp(-rate * N**exponent), N the free neutrons, except in the first
+`delay` steps (the initial cooldown and travel time of the particle model). A split takes one
+uranium, adds one barium, one krypton and 2 or 3 neutrons (even odds); neutrons are never lost.
+Thousands of replicas run at once as numpy arrays, so a scan point takes seconds.
+
+rate, exponent and delay are fitted to the cached particle runs (looked up in core.catalog) with
+the same uranium_start, bounding_parameter and fission probability; neutrons_start is free.
+--backend fits on the runs of one backend only, by default all of them are used and the backends
+are listed with the fit. The fit error is measured by running the surrogate against those runs.
+
+    python -m core.surrogate --uranium-start 1000 --neutrons-start 10 50 100 --replicas 5000
+"""
+import argparse
+import itertools
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+
+from core.catalog import Catalog
+from core.ensemble import COUNT_KEYS, _optional_float, _padded, summarize, time_to_threshold
+from core.kernels import BACKENDS
+from core.parameters import (
+    bounding_parameter,
+    fission_prob_hardcoded_parameter,
+    neutrons_start,
+    threshold_factor_uranium,
+    uranium_start,
+    simulation_steps,
+)
+from core.run_cache import CACHE_ROOT
+
+NEUTRONS_PER_FISSION = 2.5 # 2 or 3 with even odds
+MAX_FIT_POINTS = 2000 # longer runs are fitted on every k-th step
+MAX_RECORDED_POINTS = 2000 # default decimation of the scan curves, replicas * points counts are held in memory
+LOG_RATES = (-12.0, 0.0)
+EXPONENTS = (0.2, 2.0)
+
+
+def calibration_runs(catalog, uranium_start, bounding_parameter, fission_prob, backend=None):
+    """[(config, counts)] of the runs at this point in `catalog` (core.catalog, sync it first).
+    backend: only the runs of this backend, None for all"""
+    equals = {} if backend is None else {"backend": backend}
+    rows = catalog.query(columns=("key", "config"), uranium_start=uranium_start, bounding_parameter=bounding_parameter,
+                         fission_prob_hardcoded_parameter=fission_prob, **equals)
+    return [(row["config"], catalog.series(row["key"])) for row in rows]
+
+
+def mean_field(rate, exponent, delay, uranium_start, neutrons_start, points, stride=1):
+    """expected uranium counts at steps 0, stride, 2 * stride, ... (`points` of them) for arrays of
+    rates and exponents (broadcast against each other), the deterministic limit of BranchingModel"""
+    rate, exponent = np.broadcast_arrays(np.asarray(rate, dtype=np.float64), np.asarray(exponent, dtype=np.float64))
+    uranium = np.full(rate.shape, float(uranium_start))
+    neutrons = np.full(rate.shape, float(neutrons_start))
+    curve = np.empty((points,) + rate.shape)
+    curve[0] = uranium
+    for k in range(1, points):
+        active = min(stride, k * stride - delay) # steps of ((k-1) * stride, k * stride] after the delay
+        if active > 0:
+            split = uranium * -np.expm1(-rate * neutrons ** exponent * active)
+            uranium = uranium - split
+            neutrons = neutrons + NEUTRONS_PER_FISSION * split
+        curve[k] = uranium
+    return curve
+
+
+class BranchingModel:
+    """the surrogate of one (uranium_start, bounding_parameter, fission probability) point, see the module docstring"""
+
+    def __init__(self, rate, exponent, delay, fit_rms=None):
+        self.rate = rate
+        self.exponent = exponent
+        self.delay = delay
+        self.fit_rms = fit_rms # of the mean-field curve against the fitted runs, relative to uranium_start
+
+    def to_dict(self):
+        return {"rate": self.rate, "exponent": self.exponent, "delay": self.delay}
+
+    def run(self, replicas, neutrons_start, uranium_start, steps, uranium_threshold_factor=threshold_factor_uranium,
+            rng=None, seed=None, every=1, record_until=None):
+        """Runs `replicas` independent replicas for up to `steps` steps, every replica stops once its
+        uranium is at or below the threshold (and keeps its counts, like ensemble.aggregate pads).
+        Returns the recorded steps (0, every, 2 * every, ... up to `record_until`, default all),
+        {count_key: (replicas, len(steps)) array} and the time to threshold of every replica (None if not reached)."""
+        rng = rng or np.random.default_rng(seed)
+        threshold = uranium_threshold_factor * uranium_start
+        uranium = np.full(replicas, uranium_start, dtype=np.int64)
+        neutrons = np.full(replicas, neutrons_start, dtype=np.int64)
+        running = np.ones(replicas, dtype=bool)
+        times = np.full(replicas, -1, dtype=np.int64)
+        recorded = np.arange(0, min(steps, steps if record_until is None else record_until) + 1, every)
+        uranium_columns, neutron_columns = [uranium.copy()], [neutrons.copy()]
+
+        for step in range(1, steps + 1):
+            active = np.flatnonzero(running)
+            if step > self.delay:
+                split = rng.binomial(uranium[active], -np.expm1(-self.rate * neutrons[active] ** self.exponent))
+                uranium[active] -= split
+                neutrons[active] += 2 * split + rng.binomial(split, 0.5) # 3 neutrons for half of them
+            reached = active[uranium[active] <= threshold]
+            times[reached] = step
+            running[reached] = False
+            if (step % every == 0 or not running.any()) and len(uranium_columns) < len(recorded):
+                uranium_columns.append(uranium.copy())
+                neutron_columns.append(neutrons.copy())
+            if not running.any():
+                break
+
+        uranium_curves = _padded(np.array(uranium_columns).T, len(recorded)).astype(np.int64) # a finished run keeps its counts
+        neutron_curves = _padded(np.array(neutron_columns).T, len(recorded)).astype(np.int64)
+        curves = {"neutron_counts": neutron_curves, "uranium_counts": uranium_curves,
+                  "barium_counts": uranium_start - uranium_curves, "krypton_counts": uranium_start - uranium_curves}
+        return recorded, curves, [int(t) if t >= 0 else None for t in times]
+
+
+def _targets(runs):
+    """(neutrons_start, number of runs, stride, mean uranium curve at every stride-th step) per neutrons_start"""
+    groups = {}
+    for config, metadata in runs:
+        groups.setdefault(config["neutrons_start"], []).append(metadata["uranium_counts"])
+    targets = []
+    for start, curves in sorted(groups.items()):
+        length = max(len(curve) for curve in curves)
+        stride = max(1, -(-(length - 1) // MAX_FIT_POINTS))
+        targets.append((start, len(curves), stride, _padded(curves, length).mean(axis=0)[::stride]))
+    return targets
+
+
+def fit(runs, delays=9, grid=(41, 13), zooms=3):
+    """BranchingModel with the least squared error of its mean-field uranium curve against the mean
+    curve of `runs` (one curve per neutrons_start). A grid search over log(rate) and the exponent,
+    narrowed `zooms` times around the best point, for each of `delays` delays up to the first fission."""
+    start = runs[0][0]["uranium_start"]
+    onsets = [drops[0] for drops in (np.flatnonzero(np.asarray(metadata["uranium_counts"]) < start) for _, metadata in runs)
+              if len(drops)]
+    if not onsets:
+        raise ValueError("none of the cached runs has a fission, there is nothing to fit")
+    targets = _targets(runs)
+    weights = sum(weight for _, weight, _, _ in targets)
+
+    best = (np.inf, None)
+    for delay in np.unique(np.linspace(0, min(onsets) - 1, delays).round().astype(int)):
+        log_rates, exponents = np.linspace(*LOG_RATES, grid[0]), np.linspace(*EXPONENTS, grid[1])
+        for _ in range(zooms):
+            error = sum(weight * ((mean_field(10.0 ** log_rates[:, None], exponents[None, :], delay, start, neutrons, len(target), stride)
+                                   - target[:, None, None]) ** 2).mean(axis=0)
+                        for neutrons, weight, stride, target in targets)
+            i, j = np.unravel_index(np.argmin(error), error.shape)
+            if error[i, j] < best[0]:
+                best = (error[i, j], BranchingModel(float(10.0 ** log_rates[i]), float(exponents[j]), int(delay)))
+            # next grid: two spacings around the best point
+            step_rate, step_exponent = log_rates[1] - log_rates[0], exponents[1] - exponents[0]
+            log_rates = np.linspace(log_rates[i] - 2 * step_rate, log_rates[i] + 2 * step_rate, grid[0])
+            exponents = np.linspace(max(exponents[j] - 2 * step_exponent, 0.0), exponents[j] + 2 * step_exponent, grid[1])
+    error, model = best
+    model.fit_rms = float(np.sqrt(error / weights) / start)
+    return model
+
+
+def fit_error(model, runs, replicas=1000, seed=0):
+    """Runs the surrogate against the cached runs of every neutrons_start: rms difference of the mean
+    uranium (relative to uranium_start) and neutron (relative to the largest mean) curves, and the
+    mean time to threshold of both."""
+    report = []
+    rng = np.random.default_rng(seed)
+    for neutrons, count, stride, _ in _targets(runs):
+        group = [(config, metadata) for config, metadata in runs if config["neutrons_start"] == neutrons]
+        start = group[0][0]["uranium_start"]
+        threshold = group[0][0].get("uranium_threshold_factor", threshold_factor_uranium)
+        length = max(len(metadata["uranium_counts"]) for _, metadata in group)
+        steps = max(config.get("simulation_steps", simulation_steps) for config, _ in group)
+        particle = {key: _padded([metadata[key] for _, metadata in group], length).mean(axis=0)[::stride]
+                    for key in ("uranium_counts", "neutron_counts")}
+        _, curves, times = model.run(replicas, neutrons, start, steps, threshold, rng=rng, every=stride, record_until=length - 1)
+
+        particle_times = [t for t in (time_to_threshold(metadata["uranium_counts"], threshold) for _, metadata in group) if t is not None]
+        surrogate_times = [t for t in times if t is not None]
+        report.append({
+            "neutrons_start": neutrons,
+            "runs": count,
+            "uranium_rms": float(np.sqrt(np.mean((curves["uranium_counts"].mean(axis=0) - particle["uranium_counts"]) ** 2)) / start),
+            "neutron_rms": float(np.sqrt(np.mean((curves["neutron_counts"].mean(axis=0) - particle["neutron_counts"]) ** 2))
+                                 / particle["neutron_counts"].max()),
+            "particle_time_to_threshold": float(np.mean(particle_times)) if particle_times else None,
+            "surrogate_time_to_threshold": float(np.mean(surrogate_times)) if surrogate_times else None,
+        })
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scan parameters with the branching-process surrogate fitted to cached runs.")
+    parser.add_argument("--uranium-start", type=int, nargs="+", default=[uranium_start])
+    parser.add_argument("--neutrons-start", type=int, nargs="+", default=[neutrons_start])
+    parser.add_argument("--bounding-parameter", type=float, nargs="+", default=[bounding_parameter])
+    parser.add_argument("--fission-prob", type=_optional_float, nargs="+", default=[fission_prob_hardcoded_parameter],
+                        help="hardcoded fission probabilities, 'none' for the cross-section formula")
+    parser.add_argument("--replicas", type=int, default=1000, help="replicas per scan point")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--steps", type=int, default=simulation_steps)
+    parser.add_argument("--threshold", type=float, default=threshold_factor_uranium)
+    parser.add_argument("--every", type=int, default=None, help=f"keep the counts of every k-th step, default about {MAX_RECORDED_POINTS} per curve")
+    parser.add_argument("--cache-root", type=Path, default=CACHE_ROOT, help="where the particle runs are cached")
+    parser.add_argument("--backend", choices=BACKENDS, default=None, help="calibrate on the runs of this backend only")
+    parser.add_argument("--out", type=Path, default=None)
+    args = parser.parse_args(argv)
+    every = args.every or max(1, -(-args.steps // MAX_RECORDED_POINTS))
+
+    points = list(itertools.product(args.uranium_start, args.bounding_parameter, args.fission_prob))
+    children = iter(np.random.SeedSequence(args.seed).spawn(len(points) * (len(args.neutrons_start) + 1)))
+    groups = []
+    start = time.perf_counter()
+    catalog = Catalog(root=args.cache_root)
+    catalog.sync() # once for the whole scan: runs cached without run_and_cache, e.g. the old folders
+    for uranium, bound, fission_prob in points:
+        runs = calibration_runs(catalog, uranium, bound, fission_prob, args.backend)
+        if not runs:
+            print(f"no cached runs for uranium_start={uranium} bounding_parameter={bound} fission_prob={fission_prob}, "
+                  "skipped (make cache)")
+            continue
+        model = fit(runs)
+        report = fit_error(model, runs, seed=next(children))
+        backends = sorted({str(config.get("backend")) for config, _ in runs})
+        print(f"uranium_start={uranium} bounding_parameter={bound} fission_prob={fission_prob}: {model.to_dict()} "
+              f"from {len(runs)} runs ({', '.join(backends)})")
+        for line in report:
+            print(f"  neutrons_start={line['neutrons_start']} uranium_rms={line['uranium_rms']:.3f} neutron_rms={line['neutron_rms']:.3f}"
+                  f" time_to_threshold particle={line['particle_time_to_threshold']} surrogate={line['surrogate_time_to_threshold']}")
+
+        for neutrons in args.neutrons_start:
+            steps, curves, times = model.run(args.replicas, neutrons, uranium, args.steps, args.threshold,
+                                             rng=np.random.default_rng(next(children)), every=every)
+            groups.append({
+                "config": {"uranium_start": uranium, "neutrons_start": neutrons, "bounding_parameter": bound,
+                           "fission_prob_hardcoded_parameter": fission_prob},
+                "replicas": args.replicas,
+                "model": model.to_dict(),
+                "fit": {"mean_field_rms": model.fit_rms, "runs": len(runs), "backends": backends, "error": report},
+                "steps": steps.tolist(),
+                **summarize({key: curves[key] for key in COUNT_KEYS}, times),
+            })
+    catalog.close()
+    print(f"{len(groups)} scan points in {time.perf_counter() - start:.1f}s")
+
+    summary = {"simulation_steps": args.steps, "uranium_threshold_factor": args.threshold, "every": every,
+               "seed": args.seed, "backend": args.backend, "groups": groups}
+    out = args.out or args.cache_root / "surrogates" / f"surrogate_{args.seed}_{int(time.time())}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with out.open("w", encoding="utf-8") as f:
+        json.dump(summary, f)
+    for group in groups:
+        ttt = group["time_to_threshold"]
+        print(group["config"], f"reached={ttt['reached_fraction']:.2f}", f"mean_steps={ttt['mean']}")
+    print(f"Surrogate summary at {out}")
+
+
+if __name__ == "__main__":
+    main()
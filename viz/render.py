@@ -0,0 +1,176 @@
+"""Headless export of a cached run to an MP4 or a PNG sequence, rendered on a process pool.
+
+    python -m viz.render                                  # latest run of core.parameters -> renders/<key>.mp4
+    python -m viz.render --key <key> --duration 60 --fps 30 --workers 16
+    python -m viz.render --run cached_runs/runs/<key> --format png --start 1000 --stop 5000
+
+The frames of [start, stop) are decimated to duration * fps evenly spaced frames, split into one
+contiguous range per job and rendered with the Agg backend, so no display is needed. For MP4 every
+job pipes raw frames into its own ffmpeg and the segments are joined without re-encoding at the end
+(needs the ffmpeg binary); PNG writes one file per output frame.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+from core.parameters import bounding_parameter
+from viz.viz_cached import frame_data, open_snapshots, run_dir
+
+RENDER_ROOT = Path(__file__).resolve().parents[1] / "renders"
+FORMATS = ("mp4", "png")
+
+
+def select_frames(frames, start=0, stop=None, duration=None, fps=30):
+    """indices of the frames to render: all of [start, stop), or duration * fps evenly spaced ones"""
+    stop = frames if stop is None else min(stop, frames)
+    if stop <= start:
+        return np.empty(0, dtype=np.int64)
+    if duration is None or duration * fps >= stop - start:
+        return np.arange(start, stop)
+    return np.unique(np.linspace(start, stop - 1, max(int(duration * fps), 1)).round().astype(np.int64))
+
+
+class FrameRenderer:
+    """one figure reused for every frame, `render(frame)` returns the image as an (h, w, 4) uint8 array"""
+
+    def __init__(self, reader, bounds, width=1280, height=720, dpi=100, every=1):
+        self.reader = reader
+        self.every = every
+        self.fig = plt.figure(figsize=(width / dpi, height / dpi), dpi=dpi)
+        ax = self.fig.add_subplot(111, projection="3d")
+        self.scatter = ax.scatter([], [], [], s=4, depthshade=False)
+        ax.set_xlim(-bounds * 1.1, bounds * 1.1)
+        ax.set_ylim(-bounds * 1.1, bounds * 1.1)
+        ax.set_zlim(-bounds * 1.1, bounds * 1.1)
+        self.title = ax.set_title("")
+
+    def draw(self, frame):
+        positions, colors = frame_data(self.reader, frame) # colours broadcast from the per-type rgba arrays
+        self.scatter._offsets3d = (positions[:, 0], positions[:, 1], positions[:, 2])
+        self.scatter.set_color(colors)
+        self.title.set_text(f"step {frame * self.every + 1}") # frame 0 is written after the first step
+        self.fig.canvas.draw()
+
+    def render(self, frame):
+        self.draw(frame)
+        return np.asarray(self.fig.canvas.buffer_rgba())
+
+    def close(self):
+        plt.close(self.fig)
+
+
+def _ffmpeg(*args):
+    return ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", *args]
+
+
+def _render_job(cache_dir, frames, first_index, out, fmt, bounds, width, height, dpi, fps):
+    """renders `frames` (output numbers from first_index) to PNGs in `out` or to the MP4 segment `out`"""
+    reader = open_snapshots(Path(cache_dir))
+    renderer = FrameRenderer(reader, bounds, width, height, dpi, reader.every)
+    try:
+        if fmt == "png":
+            for number, frame in enumerate(frames, first_index):
+                plt.imsave(Path(out) / f"frame_{number:06d}.png", renderer.render(frame)) # the drawn canvas, not a second render
+            return len(frames)
+
+        encoder = None
+        for frame in frames:
+            image = renderer.render(frame)
+            if encoder is None: # size of what Agg actually produced
+                encoder = subprocess.Popen(_ffmpeg("-f", "rawvideo", "-pix_fmt", "rgba", "-s", f"{image.shape[1]}x{image.shape[0]}",
+                                                   "-r", str(fps), "-i", "-", "-c:v", "libx264", "-pix_fmt", "yuv420p", str(out)),
+                                           stdin=subprocess.PIPE)
+            encoder.stdin.write(image.tobytes())
+        encoder.stdin.close()
+        if encoder.wait():
+            raise RuntimeError(f"ffmpeg failed on {out}")
+        return len(frames)
+    finally:
+        renderer.close()
+
+
+def export(cache_dir, out, fmt="mp4", start=0, stop=None, duration=None, fps=30, workers=None,
+           width=1280, height=720, dpi=100, jobs_per_worker=2):
+    """renders a cached run to `out` (an .mp4 file or a directory of PNGs), returns the number of frames"""
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown format {fmt!r}, expected one of {FORMATS}")
+    if fmt == "mp4" and shutil.which("ffmpeg") is None:
+        raise RuntimeError("MP4 export needs ffmpeg on the PATH, use --format png otherwise")
+    width, height = width // 2 * 2, height // 2 * 2 # yuv420p wants even sizes
+
+    cache_dir = Path(cache_dir)
+    frames = select_frames(len(open_snapshots(cache_dir)), start, stop, duration, fps)
+    if not len(frames):
+        raise ValueError("no frames in the selected range")
+    bounds = bounding_parameter
+    config_path = cache_dir / "run_config.json"
+    if config_path.exists():
+        with config_path.open("r", encoding="utf-8") as f:
+            bounds = json.load(f).get("bounding_parameter", bounds)
+
+    workers = workers or os.cpu_count() or 1
+    chunks = [chunk for chunk in np.array_split(frames, min(len(frames), workers * jobs_per_worker)) if len(chunk)]
+    firsts = np.cumsum([0] + [len(chunk) for chunk in chunks[:-1]])
+    out = Path(out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+
+    with tempfile.TemporaryDirectory(dir=out.parent) as tmp:
+        if fmt == "png":
+            out.mkdir(exist_ok=True)
+            targets = [out] * len(chunks)
+        else:
+            targets = [Path(tmp) / f"segment_{k:04d}.mp4" for k in range(len(chunks))]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            done = sum(pool.map(_render_job, [cache_dir] * len(chunks), chunks, firsts, targets, [fmt] * len(chunks),
+                                [bounds] * len(chunks), [width] * len(chunks), [height] * len(chunks),
+                                [dpi] * len(chunks), [fps] * len(chunks)))
+        if fmt == "mp4": # join the segments as they are
+            segment_list = Path(tmp) / "segments.txt"
+            segment_list.write_text("".join(f"file '{target}'\n" for target in targets), encoding="utf-8")
+            subprocess.run(_ffmpeg("-f", "concat", "-safe", "0", "-i", str(segment_list), "-c", "copy", str(out)), check=True)
+    return done
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render a cached run to MP4 or PNGs without a display.")
+    parser.add_argument("--key", default=None, help="cache key (python -m core.run_cache list)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--run", type=Path, default=None, help="any run directory")
+    parser.add_argument("--format", choices=FORMATS, default="mp4")
+    parser.add_argument("--out", type=Path, default=None, help=f"default {RENDER_ROOT.name}/<run>.mp4 or {RENDER_ROOT.name}/<run>/")
+    parser.add_argument("--start", type=int, default=0, help="first stored frame")
+    parser.add_argument("--stop", type=int, default=None, help="stored frame to stop before")
+    parser.add_argument("--duration", type=float, default=None, help="seconds of output, frames are decimated to fit")
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--workers", type=int, default=None, help="render processes, default one per core")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--dpi", type=int, default=100)
+    args = parser.parse_args(argv)
+
+    cache_dir = args.run or run_dir(args.key, args.seed)
+    if cache_dir is None or not cache_dir.exists():
+        raise SystemExit(f"No cached run found ({cache_dir or 'current parameters, seed ' + str(args.seed)}), run `make cache` first")
+    out = args.out or RENDER_ROOT / (f"{cache_dir.name}.mp4" if args.format == "mp4" else cache_dir.name)
+    try:
+        frames = export(cache_dir, out, args.format, args.start, args.stop, args.duration, args.fps, args.workers,
+                        args.width, args.height, args.dpi)
+    except (RuntimeError, ValueError) as error:
+        raise SystemExit(str(error))
+    print(f"Rendered {frames} frames to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,15 @@
+import argparse
 import json
 from pathlib import Path
 
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
+from matplotlib.colors import to_rgba
 
-from core.parameters import (
-    bounding_parameter,
-    fission_prob_hardcoded_parameter,
-    neutrons_start,
-    uranium_start,
-)
+from core.parameters import bounding_parameter
+from core.run_cache import RunCache, parameter_set
+from core.snapshots import SnapshotReader, convert_npz
 
 TYPES = ("neutron", "uranium_235", "barium", "krypton")
 TYPE_COLORS = {
@@ -20,36 +19,55 @@ TYPE_COLORS = {
     "krypton": "#e15759",
 }
 DEFAULT_COLOR = "#9c9c9c"
+# rgba computed once, frames only broadcast them
+TYPE_COLOR_ARRAYS = {t: np.array(to_rgba(color)) for t, color in TYPE_COLORS.items()}
+DEFAULT_COLOR_ARRAY = np.array(to_rgba(DEFAULT_COLOR))
 
 
-def run_dir():
-    base_dir = Path(__file__).resolve().parents[1] / "cached_runs"
-    return base_dir / (
-        f"{uranium_start}_{neutrons_start}_{bounding_parameter}_{fission_prob_hardcoded_parameter}"
-    )
+def run_dir(key=None, seed=0):
+    """cached run `key`, by default the most recently used run of the current core.parameters and seed"""
+    cache = RunCache()
+    if key is not None:
+        return cache.path(key)
+    criteria = parameter_set()
+    del criteria["simulation_steps"] # any length
+    return cache.find(**criteria, seed=seed)
 
 
-def frame_data(npz, frame):
+def open_snapshots(cache_dir):
+    """lazy reader for a cached run, old snapshots.npz archives are converted once"""
+    snapshot_dir = cache_dir / "snapshots"
+    if not (snapshot_dir / "manifest.json").exists() and (cache_dir / "snapshots.npz").exists():
+        print(f"Converting {cache_dir / 'snapshots.npz'} ...")
+        convert_npz(cache_dir / "snapshots.npz", snapshot_dir)
+    return SnapshotReader(snapshot_dir)
+
+
+def frame_data(reader, frame):
     positions = []
     colors = []
-    for t in TYPES:
-        offsets = npz[f"{t}_offsets"]
-        pos = npz[f"{t}_pos"]
-        start, end = offsets[frame], offsets[frame + 1]
-        if end > start:
-            positions.append(pos[start:end])
-            colors.extend([TYPE_COLORS.get(t, DEFAULT_COLOR)] * (end - start))
+    for t in reader.types:
+        pos = reader.type_positions(t, frame)
+        if len(pos):
+            positions.append(pos)
+            colors.append(np.broadcast_to(TYPE_COLOR_ARRAYS.get(t, DEFAULT_COLOR_ARRAY), (len(pos), 4)))
     if positions:
-        return np.vstack(positions), colors
-    return np.empty((0, 3), dtype=np.float32), []
+        return np.vstack(positions), np.concatenate(colors)
+    return np.empty((0, 3), dtype=np.float32), np.empty((0, 4))
+
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a cached run.")
+    parser.add_argument("--key", default=None, help="cache key (python -m core.run_cache list)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--run", type=Path, default=None, help="any run directory, e.g. an old cached_runs/<name>")
+    args = parser.parse_args(argv)
 
-def main():
-    cache_dir = run_dir()
-    if not cache_dir.exists():
-        raise SystemExit(f"Cache folder not found: {cache_dir}")
+    cache_dir = args.run or run_dir(args.key, args.seed)
+    if cache_dir is None or not cache_dir.exists():
+        raise SystemExit(f"No cached run found ({cache_dir or 'current parameters, seed ' + str(args.seed)}), run `make cache` first")
 
-    npz = np.load(cache_dir / "snapshots.npz")
+    reader = open_snapshots(cache_dir)
     with (cache_dir / "metadata.json").open("r", encoding="utf-8") as f:
         metadata = json.load(f)
 
@@ -60,9 +78,9 @@ def main():
             config = json.load(f)
         bounds = config.get("bounding_parameter", bounds)
 
-    frames = len(npz[f"{TYPES[0]}_offsets"]) - 1
+    frames = len(reader)
 
-    pos0, colors0 = frame_data(npz, 0)
+    pos0, colors0 = frame_data(reader, 0)
 
     fig = plt.figure()
     ax = fig.add_subplot(111, projection="3d")
@@ -72,7 +90,7 @@ def main():
     ax.set_zlim(-bounds * 1.1, bounds * 1.1)
 
     def update(frame):
-        pos, colors = frame_data(npz, frame)
+        pos, colors = frame_data(reader, frame)
         if pos.size == 0:
             sc._offsets3d = ([], [], [])
             sc.set_color([])